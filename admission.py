@@ -0,0 +1,217 @@
+import os
+import math
+import time
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+# Per-client buckets kept; the least recently seen clients are dropped first.
+MAX_TRACKED_CLIENTS = 10000
+
+class Rejected(Exception):
+    """
+    Raised when a request is not admitted. retry_after is in whole seconds.
+    """
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """
+    Refills `rate` tokens per second up to `capacity`; each request takes one.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        """
+        Takes a token and returns 0, or returns the seconds until one is available.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+class ClientRateLimiter:
+    """
+    Token-bucket rate limiting per client (e.g. remote address).
+    A rate of 0 disables it.
+    """
+
+    def __init__(self, per_minute, burst):
+        self.rate = per_minute / 60
+        self.burst = max(1, burst)
+        self.buckets = OrderedDict()
+        self.limited = 0
+        self.lock = threading.Lock()
+
+    def check(self, client):
+        if self.rate <= 0:
+            return
+        with self.lock:
+            bucket = self.buckets.pop(client, None) or TokenBucket(self.rate, self.burst)
+            self.buckets[client] = bucket
+            if len(self.buckets) > MAX_TRACKED_CLIENTS:
+                self.buckets.popitem(last=False)
+            wait = bucket.take()
+            if wait:
+                self.limited += 1
+                raise Rejected('rate_limited', math.ceil(wait))
+
+    def stats(self):
+        with self.lock:
+            return {
+                'per_minute': self.rate * 60,
+                'burst': self.burst,
+                'tracked_clients': len(self.buckets),
+                'limited': self.limited
+            }
+
+class AdmissionLane:
+    """
+    Runs at most max_active requests at a time. Up to max_queued more wait (up
+    to queue_timeout seconds) for a slot; beyond that requests are rejected
+    immediately, so an overloaded server answers fast instead of letting work
+    pile up until everything times out together.
+    """
+
+    def __init__(self, name, max_active, max_queued, queue_timeout):
+        self.name = name
+        self.max_active = max(1, max_active)
+        self.max_queued = max(0, max_queued)
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.completed = 0
+        # Exponentially weighted mean of time spent in the lane, for Retry-After.
+        self.mean_duration = None
+        self.condition = threading.Condition()
+
+    def retry_after(self):
+        # Time for the requests ahead (running and queued) to drain.
+        mean_duration = self.mean_duration or 1.0
+        return max(1, math.ceil(mean_duration * (self.active + self.queued) / self.max_active))
+
+    def acquire(self):
+        with self.condition:
+            if self.active < self.max_active and self.queued == 0:
+                self.active += 1
+                self.admitted += 1
+                return
+            if self.queued >= self.max_queued:
+                self.rejected += 1
+                raise Rejected('queue_full', self.retry_after())
+
+            self.queued += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self.active >= self.max_active:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        raise Rejected('queue_timeout', self.retry_after())
+                    self.condition.wait(remaining)
+            finally:
+                self.queued -= 1
+            self.active += 1
+            self.admitted += 1
+
+    def release(self, duration):
+        with self.condition:
+            self.active -= 1
+            self.completed += 1
+            if self.mean_duration is None:
+                self.mean_duration = duration
+            else:
+                self.mean_duration = 0.8 * self.mean_duration + 0.2 * duration
+            self.condition.notify()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def stats(self):
+        with self.condition:
+            return {
+                'active': self.active,
+                'queued': self.queued,
+                'max_active': self.max_active,
+                'max_queued': self.max_queued,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'completed': self.completed,
+                'mean_duration': self.mean_duration
+            }
+
+class AdmissionController:
+    """
+    Per-client rate limiting plus two lanes: 'heavy' for analyses that fetch
+    comments or train models, 'light' for requests answered from cached
+    comments and stored analysis state, so cheap requests are never stuck
+    behind LDA sweeps. Limits apply per process (per gunicorn worker).
+    """
+
+    def __init__(self, heavy_active=2, heavy_queued=2, light_active=4, light_queued=8,
+                 queue_timeout=30.0, rate_per_minute=30, rate_burst=10):
+        self.lanes = {
+            'heavy': AdmissionLane('heavy', heavy_active, heavy_queued, queue_timeout),
+            'light': AdmissionLane('light', light_active, light_queued, queue_timeout)
+        }
+        self.rate_limiter = ClientRateLimiter(rate_per_minute, rate_burst)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            heavy_active=int(os.getenv('ANALYZE_MAX_ACTIVE', '2')),
+            heavy_queued=int(os.getenv('ANALYZE_MAX_QUEUE', '2')),
+            light_active=int(os.getenv('ANALYZE_LIGHT_MAX_ACTIVE', '4')),
+            light_queued=int(os.getenv('ANALYZE_LIGHT_MAX_QUEUE', '8')),
+            queue_timeout=float(os.getenv('ANALYZE_QUEUE_TIMEOUT', '30')),
+            rate_per_minute=float(os.getenv('ANALYZE_RATE_PER_MINUTE', '30')),
+            rate_burst=int(os.getenv('ANALYZE_RATE_BURST', '10'))
+        )
+
+    def check_rate(self, client):
+        self.rate_limiter.check(client)
+
+    def slot(self, lane):
+        return self.lanes[lane].slot()
+
+    def admit(self, lane):
+        """
+        Takes a slot outside a with block, for work handed to another thread.
+        Returns the function that releases it.
+        """
+        lane = self.lanes[lane]
+        lane.acquire()
+        started = time.monotonic()
+        return lambda: lane.release(time.monotonic() - started)
+
+    def stats(self):
+        return {
+            'pid': os.getpid(),
+            'lanes': {name: lane.stats() for name, lane in self.lanes.items()},
+            'rate_limit': self.rate_limiter.stats()
+        }
@@ -0,0 +1,65 @@
+"""
+Compares the memory held by the per-request corpus representations:
+the previous list-based pipeline (processed strings, tokenized lists, BoW
+tuple lists and one coherence `doc.split()` copy) against CompactCorpus.
+
+    python benchmarks/corpus_memory.py --comments 500 --comments 100000
+"""
+import os
+import sys
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gensim import corpora
+from compact_corpus import CompactCorpus
+
+def synthetic_comments(count, vocabulary_size=20000, seed=42):
+    rng = random.Random(seed)
+    vocabulary = [f'word{i}' for i in range(vocabulary_size)]
+    weights = [1 / (rank + 1) for rank in range(vocabulary_size)]
+    return [
+        ' '.join(rng.choices(vocabulary, weights=weights, k=rng.randint(3, 40)))
+        for _ in range(count)
+    ]
+
+def measure(build):
+    tracemalloc.start()
+    result = build()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak
+
+def preprocessed(texts):
+    # Stand-in for preprocess_text: yields a fresh string per comment.
+    return (' '.join(text.split()) for text in texts)
+
+def list_pipeline(texts):
+    processed_comments = list(preprocessed(texts))
+    tokenized_comments = [comment.split() for comment in processed_comments]
+    dictionary = corpora.Dictionary(tokenized_comments)
+    corpus = [dictionary.doc2bow(text) for text in tokenized_comments]
+    coherence_texts = [doc.split() for doc in processed_comments]
+    return processed_comments, tokenized_comments, dictionary, corpus, coherence_texts
+
+def compact_pipeline(texts):
+    return CompactCorpus.from_texts(preprocessed(texts))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--comments', type=int, action='append', help='Number of comments (repeatable).')
+    args = parser.parse_args()
+
+    print(f"{'comments':>10} {'lists (KiB)':>14} {'compact (KiB)':>14} {'reduction':>10}")
+    for count in args.comments or [500, 10000, 100000]:
+        texts = synthetic_comments(count)
+        # The raw comments exist in both pipelines; only count what each builds.
+        _, list_bytes, _ = measure(lambda: list_pipeline(texts))
+        _, compact_bytes, _ = measure(lambda: compact_pipeline(texts))
+        print(f"{count:>10} {list_bytes / 1024:>14.1f} {compact_bytes / 1024:>14.1f} "
+              f"{1 - compact_bytes / list_bytes:>9.1%}")
+
+if __name__ == '__main__':
+    main()
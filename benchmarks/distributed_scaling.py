@@ -0,0 +1,90 @@
+"""
+Times a full analysis single-node and with 1, 2 and 4 distributed workers
+(worker processes on this machine, behind a broker served over HTTP), and
+checks that every distributed run returns exactly the single-node result.
+Key phrases come from the local OpenAI stand-in, so no API key is needed.
+
+    python benchmarks/distributed_scaling.py --comments 4000 --workers 1 2 4
+
+Worker processes share this machine's cores; for multi-node numbers, run
+`python distributed.py worker` on other hosts against --broker-host 0.0.0.0.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'loadtest'))
+
+from stub_servers import WORDS, OpenAIStubHandler, StubConfig, start_stub_server
+
+_, openai_url = start_stub_server(OpenAIStubHandler, StubConfig())
+os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+os.environ['OPENAI_API_BASE'] = f'{openai_url}/v1'
+
+from comment_analysis import analyze_comments_with_model
+from distributed import Broker, BrokerClient, serve_broker, start_worker_processes, use_broker
+
+EXTRA_WORDS = (
+    'really watched again channel subscribe explained clearly worst ever awesome content best part '
+    'terrible waste time learned much recommend friends excited next episode disappointed quality'
+).split()
+
+def synthetic_comments(count, seed=42):
+    rng = random.Random(seed)
+    vocabulary = WORDS + EXTRA_WORDS
+    return [' '.join(rng.choices(vocabulary, k=rng.randint(4, 30))) for _ in range(count)]
+
+def timed_analysis(comments):
+    started = time.monotonic()
+    analysis = analyze_comments_with_model(comments)
+    return analysis, time.monotonic() - started
+
+def wait_for_workers(client, count, timeout=60):
+    deadline = time.monotonic() + timeout
+    while client.live_workers() < count:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Only {client.live_workers()} of {count} workers connected")
+        time.sleep(0.2)
+
+def run_distributed(comments, workers, broker_host):
+    server, url = serve_broker(Broker(), host=broker_host)
+    processes = start_worker_processes(url, workers)
+    try:
+        client = BrokerClient(url)
+        wait_for_workers(client, workers)
+        use_broker(client)
+        return timed_analysis(comments)
+    finally:
+        use_broker(None)
+        for process in processes:
+            process.terminate()
+            process.join()
+        server.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--comments', type=int, default=4000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--broker-host', default='127.0.0.1')
+    args = parser.parse_args()
+
+    comments = synthetic_comments(args.comments)
+    # Load the NLP models before timing anything
+    analyze_comments_with_model(synthetic_comments(50, seed=1))
+    baseline, baseline_seconds = timed_analysis(comments)
+    if baseline is None:
+        sys.exit('Single-node analysis failed; see the log above.')
+
+    print(f"{os.cpu_count()} CPUs, {args.comments} comments")
+    print(f"{'workers':>8} {'seconds':>9} {'speedup':>8} {'identical':>10}")
+    print(f"{'local':>8} {baseline_seconds:>9.2f} {1:>8.2f} {'-':>10}")
+    for workers in args.workers:
+        analysis, seconds = run_distributed(comments, workers, args.broker_host)
+        print(f"{workers:>8} {seconds:>9.2f} {baseline_seconds / seconds:>8.2f} {str(analysis == baseline):>10}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+Times keyword search (search_index.evaluate_query) on a synthetic column
+store index with Zipf-distributed terms: a common term, a rare term, an AND
+query, an OR query and prefix queries of growing fan-out.
+
+    python benchmarks/search_latency.py --rows 100000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_index import write_inverted_index, load_inverted_index, evaluate_query
+
+QUERIES = ('w1', 'w5000', 'w1 w2', 'w3 OR w4', 'w1 w2 OR w3 w4', 'w19*', 'w1*')
+
+def synthetic_token_lists(rows, vocabulary_size=20000, seed=42):
+    rng = random.Random(seed)
+    vocabulary = [f'w{i}' for i in range(vocabulary_size)]
+    weights = [1 / (rank + 1) for rank in range(vocabulary_size)]
+    return [rng.choices(vocabulary, weights=weights, k=rng.randint(3, 40)) for _ in range(rows)]
+
+def time_query(index, query, rows, repeat):
+    evaluate_query(index, query, rows)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        matches = evaluate_query(index, query, rows)
+    return (time.perf_counter() - started) / repeat, len(matches)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        write_inverted_index(index_dir, synthetic_token_lists(args.rows))
+        index = load_inverted_index(index_dir)
+        print(f"{args.rows} rows, {len(index['terms'])} terms")
+        print(f"{'query':>16} {'matches':>8} {'ms':>8}")
+        for query in QUERIES:
+            seconds, matches = time_query(index, query, args.rows, args.repeat)
+            print(f"{query:>16} {matches:>8} {seconds * 1000:>8.3f}")
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,7 @@
 import re
 import logging
 from collections import Counter
-from textblob import TextBlob
+from textblob.en import sentiment as pattern_sentiment
 import nltk
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
@@ -11,9 +11,13 @@ from plotly.utils import PlotlyJSONEncoder
 import json
 import text2emotion as te
 from gensim.models import CoherenceModel, LdaModel
-from gensim import corpora
 import traceback
 from openai_api import generate_key_phrases
+from compact_corpus import CompactCorpus
+from profiles import stage_timer, stage_costs, DEFAULT_NUM_TOPICS, BUDGET_SAFETY
+from distributed import get_coordinator, DistributedError, SHARD_SIZE, MIN_DISTRIBUTED_COMMENTS, TASK_TIMEOUT
+import numpy as np
+import time
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -37,65 +41,157 @@ def preprocess_text(text):
         logger.error(f'Error in preprocess_text: {str(e)}')
         return ''
 
-def classify_comment(comment):
+def get_sentiment_score(tokens):
+    # Same polarity as TextBlob(' '.join(tokens)).sentiment.polarity, scored
+    # straight from the preprocessed tokens instead of re-tokenizing the text.
     try:
-        blob = TextBlob(comment)
-        sentiment_score = blob.sentiment.polarity
-
-        if sentiment_score > 0.1:
-            return 'Positive'
-        elif sentiment_score < -0.1:
-            return 'Negative'
-        else:
-            return 'Neutral'
+        assessments = pattern_sentiment.assessments(((token, None) for token in tokens), negation=True)
+        return sum(polarity for _, polarity, _, _ in assessments) / float(len(assessments) or 1)
     except Exception as e:
-        logger.error(f'Error in classify_comment: {str(e)}')
+        logger.error(f'Error in get_sentiment_score: {str(e)}')
+        return 0.0
+
+def sentiment_label(sentiment_score):
+    if sentiment_score > 0.1:
+        return 'Positive'
+    elif sentiment_score < -0.1:
+        return 'Negative'
+    else:
         return 'Neutral'
 
+def classify_comment(comment):
+    return sentiment_label(get_sentiment_score(comment.split()))
+
+def label_comment(comment):
+    try:
+        return classify_comment(preprocess_text(comment)), te.get_emotion(comment)
+    except Exception as e:
+        logger.error(f'Error in label_comment: {str(e)}')
+        return 'Neutral', {}
+
 def generate_summary(classification_counts, total_comments):
     try:
-        summary = f"Analysis of {total_comments} comments:\n"
+        summary = f"Analysis of {total_comments:.0f} comments:\n"
         for category, count in classification_counts.items():
             percentage = (count / total_comments) * 100
-            summary += f"- {category}: {count} ({percentage:.1f}%)\n"
+            summary += f"- {category}: {count:.0f} ({percentage:.1f}%)\n"
         return summary
     except Exception as e:
         logger.error(f'Error in generate_summary: {str(e)}')
         return ''
 
-def determine_optimal_topics(processed_comments, dictionary, corpus, start=2, limit=10, step=1):
+def score_topic_count(texts, dictionary, corpus, num_topics, passes):
+    """
+    Fits one candidate LDA model and returns its c_v coherence, with the
+    seconds spent fitting and scoring it. One step of the topic sweep, run
+    here or by a distributed worker.
+    """
+    started = time.monotonic()
+    model = LdaModel(
+        corpus=corpus,
+        id2word=dictionary,
+        num_topics=num_topics,
+        random_state=42,
+        update_every=1,
+        chunksize=100,
+        passes=passes,
+        alpha='auto',
+        per_word_topics=True
+    )
+    fitted = time.monotonic()
+    coherencemodel = CoherenceModel(
+        model=model,
+        texts=texts,
+        dictionary=dictionary,
+        coherence='c_v'
+    )
+    coherence = coherencemodel.get_coherence()
+    return coherence, {'lda': fitted - started, 'coherence': time.monotonic() - fitted}
+
+def record_sweep_costs(num_docs, passes, timings):
+    stage_costs.record('lda', num_docs * passes, timings['lda'])
+    stage_costs.record('coherence', num_docs, timings['coherence'])
+
+def sweep_distributed(coordinator, corpus, candidates, passes, budget=None, reserve=0.0):
+    """
+    Scores the candidate topic counts on the workers, one task each, and
+    returns (num_topics, coherence) pairs. With a deadline, candidates whose
+    results would arrive too late to fit the final model are left out.
+    """
+    deadline_bound = budget is not None and budget.deadline is not None
+    timeout = max(0.0, budget.remaining() * BUDGET_SAFETY - reserve) if deadline_bound else TASK_TIMEOUT
+    batch = coordinator.submit(
+        'coherence', [{'num_topics': num_topics, 'passes': passes} for num_topics in candidates],
+        shared=corpus.to_payload()
+    )
+    scored = []
+    for num_topics, result in zip(candidates, batch.results(timeout=timeout, partial=deadline_bound)):
+        if result is None:
+            continue
+        record_sweep_costs(len(corpus), passes, result['timings'])
+        scored.append((num_topics, result['coherence']))
+        logger.info(f"Coherence Score for {num_topics} topics: {result['coherence']}")
+    if len(scored) < len(candidates):
+        budget.mark_partial('topics', f"topic sweep scored {len(scored)} of {len(candidates)} topic counts to meet the deadline")
+    return scored
+
+def determine_optimal_topics(texts, dictionary, corpus, start=2, limit=10, step=1, passes=10, budget=None, reserve=0.0):
+    """
+    Picks the topic count with the best c_v coherence. With a broker and live
+    workers, the candidates are scored in parallel on the workers. With a
+    budget, the sweep stops early once another model would leave less than
+    `reserve` seconds (the final model's estimated cost) before the deadline.
+    """
     try:
-        coherence_scores = []
-        model_list = []
-        for num_topics in range(start, limit + 1, step):
-            model = LdaModel(
-                corpus=corpus,
-                id2word=dictionary,
-                num_topics=num_topics,
-                random_state=42,
-                update_every=1,
-                chunksize=100,
-                passes=10,
-                alpha='auto',
-                per_word_topics=True
-            )
-            model_list.append(model)
-            coherencemodel = CoherenceModel(
-                model=model,
-                texts=[doc.split() for doc in processed_comments],
-                dictionary=dictionary,
-                coherence='c_v'
-            )
-            coherence = coherencemodel.get_coherence()
-            coherence_scores.append(coherence)
-            logger.info(f"Coherence Score for {num_topics} topics: {coherence}")
-        optimal_index = coherence_scores.index(max(coherence_scores))
-        optimal_num_topics = start + optimal_index * step
+        candidates = list(range(start, limit + 1, step))
+        scored = None
+        coordinator = get_coordinator()
+        if coordinator and len(candidates) > 1 and coordinator.available():
+            try:
+                scored = sweep_distributed(coordinator, corpus, candidates, passes, budget, reserve)
+            except DistributedError as e:
+                logger.warning(f"Distributed topic sweep failed, running it locally: {str(e)}")
+        if scored is None:
+            scored = []
+            for num_topics in candidates:
+                if budget and scored and not budget.affords_seconds(budget.sweep_cost(len(corpus), 1, passes) + reserve):
+                    budget.mark_partial('topics', f"topic sweep stopped after {scored[-1][0]} topics to meet the deadline")
+                    break
+                coherence, timings = score_topic_count(texts, dictionary, corpus, num_topics, passes)
+                record_sweep_costs(len(corpus), passes, timings)
+                scored.append((num_topics, coherence))
+                logger.info(f"Coherence Score for {num_topics} topics: {coherence}")
+        if not scored:
+            return DEFAULT_NUM_TOPICS
+        optimal_num_topics = max(scored, key=lambda item: item[1])[0]
         logger.info(f"Optimal number of topics determined: {optimal_num_topics}")
         return optimal_num_topics
     except Exception as e:
         logger.error(f'Error in determine_optimal_topics: {str(e)}')
-        return 5
+        return DEFAULT_NUM_TOPICS
+
+def choose_num_topics(corpus, budget=None):
+    """
+    Runs the topic sweep (as planned by the budget, if any) and returns the
+    topic count and the number of passes for the final model.
+    """
+    if budget is None:
+        return determine_optimal_topics(corpus.texts(), corpus.dictionary, corpus), 10
+
+    plan = budget.plan_topics(len(corpus))
+    if plan['limit'] is None:
+        return DEFAULT_NUM_TOPICS, plan['passes']
+    sweep_corpus = corpus
+    if plan['sample'] < len(corpus):
+        # A fixed-seed sample, so repeated analyses pick the same documents
+        indices = np.sort(np.random.default_rng(42).choice(len(corpus), plan['sample'], replace=False))
+        sweep_corpus = corpus.subset(indices)
+    reserve = stage_costs.estimate('lda', len(corpus) * plan['passes'])
+    num_topics = determine_optimal_topics(
+        sweep_corpus.texts(), corpus.dictionary, sweep_corpus, start=plan['start'], limit=plan['limit'],
+        passes=plan['sweep_passes'], budget=budget, reserve=reserve
+    )
+    return num_topics, plan['passes']
 
 def create_sentiment_chart(classification_counts):
     try:
@@ -185,93 +281,283 @@ def create_emotion_chart(emotion_counts):
         logger.error(f'Error creating emotion chart: {str(e)}')
         return '{}'
 
-def analyze_comments_with_model(comments):
+def extract_top_topics(lda_model):
+    top_topics = []
+    for topic_idx in range(lda_model.num_topics):
+        topic = lda_model.show_topic(topic_idx, topn=10)
+        words = [word for word, prob in topic]
+        top_topics.append({
+            'id': topic_idx,
+            'words': words,
+            'weight': float(sum([prob for word, prob in topic]))
+        })
+    return top_topics
+
+def get_topic_distribution(lda_model, bow):
+    topics = lda_model.get_document_topics(bow, per_word_topics=False)
+    return [[int(topic_id), float(prob)] for topic_id, prob in topics]
+
+# Result sections in the order they become available, with the keys each one
+# fills in; /analyze streams them one by one.
+ANALYSIS_SECTIONS = (
+    ('sentiment', ('summary', 'classification', 'sentiment_chart')),
+    ('emotions', ('emotion_chart',)),
+    ('key_phrases', ('key_phrases',)),
+    ('topics', ('top_topics', 'topics_chart'))
+)
+
+def build_sentiment_section(classification_counts, total_comments):
+    return {
+        'summary': generate_summary(classification_counts, total_comments),
+        'classification': classification_html_func(classification_counts),
+        'sentiment_chart': create_sentiment_chart(classification_counts)
+    }
+
+def build_emotions_section(emotion_counts):
+    return {'emotion_chart': create_emotion_chart(emotion_counts)}
+
+def build_key_phrases_section(key_phrases):
+    return {'key_phrases': key_phrases_html_func(key_phrases)}
+
+def build_topics_section(top_topics):
+    return {
+        'top_topics': topics_html_func(top_topics),
+        'topics_chart': create_topics_chart(top_topics)
+    }
+
+def coherence_task(args, shared):
+    corpus = CompactCorpus.from_payload(shared)
+    coherence, timings = score_topic_count(corpus.texts(), corpus.dictionary, corpus, args['num_topics'], args['passes'])
+    return {'coherence': coherence, 'timings': timings}
+
+# Tasks distributed workers run: kind -> function(args, shared) returning JSON-serializable results
+WORKER_TASKS = {
+    'preprocess': lambda args, shared: [preprocess_text(comment) for comment in args['comments']],
+    'emotions': lambda args, shared: [te.get_emotion(comment) for comment in args['comments']],
+    'coherence': coherence_task
+}
+
+def comment_shards(comments):
+    return [{'comments': comments[index:index + SHARD_SIZE]} for index in range(0, len(comments), SHARD_SIZE)]
+
+def submit_comment_stages(comments, labeled_comments):
+    """
+    With a broker and live workers, submits preprocessing of a large analysis
+    (and emotion scoring of its labeled comments) as comment shards and returns
+    the two batches; otherwise returns (None, None).
+    """
+    coordinator = get_coordinator()
+    if not coordinator or len(comments) < MIN_DISTRIBUTED_COMMENTS or not coordinator.available():
+        return None, None
+    try:
+        return (coordinator.submit('preprocess', comment_shards(comments)),
+                coordinator.submit('emotions', comment_shards(labeled_comments)))
+    except DistributedError as e:
+        logger.warning(f"Distributing comment stages failed, running them locally: {str(e)}")
+        return None, None
+
+def run_comment_stage(batch, comments, compute, stage, budget=None):
+    """
+    A per-comment stage's results: the workers' shards merged in order, or
+    compute(comments) when there is no batch or it fails. Under a deadline,
+    the workers get until there is just enough time left (by the stage's
+    measured cost) to compute the shards still missing locally.
+    """
+    if batch is None:
+        return list(compute(comments))
+    timeout = TASK_TIMEOUT
+    if budget is not None and budget.deadline is not None:
+        timeout = max(0.0, budget.timeout() - stage_costs.estimate(stage, len(comments)))
+    try:
+        shards = batch.results(timeout=timeout, partial=True)
+    except DistributedError as e:
+        logger.warning(f"Distributed {batch.kind} failed, running it locally: {str(e)}")
+        return list(compute(comments))
+    missing = sum(shard is None for shard in shards)
+    if missing:
+        logger.warning(f"{missing} of {len(shards)} distributed {batch.kind} shards timed out, running them locally")
+    values = []
+    for index, shard in enumerate(shards):
+        values.extend(shard if shard is not None else compute(comments[index * SHARD_SIZE:(index + 1) * SHARD_SIZE]))
+    return values
+
+def train_lda(corpus, dictionary, num_topics, passes, budget=None):
+    """
+    Trains the final LDA model. Under a deadline it is trained one pass at a
+    time, stopping (and marking topics partial) once the next pass no longer
+    fits; the first pass always runs.
+    """
+    options = dict(id2word=dictionary, num_topics=num_topics, random_state=42, update_every=1, chunksize=100,
+                   alpha='auto', per_word_topics=True)
+    if budget is None or budget.deadline is None:
+        with stage_timer('lda', len(corpus) * passes):
+            return LdaModel(corpus=corpus, passes=passes, **options)
+
+    with stage_timer('lda', len(corpus)):
+        lda_model = LdaModel(corpus=corpus, passes=1, **options)
+    for done in range(1, passes):
+        if not budget.affords('lda', len(corpus)):
+            budget.mark_partial('topics', f"final model stopped after {done} of {passes} passes to meet the deadline")
+            break
+        with stage_timer('lda', len(corpus)):
+            lda_model.update(corpus, passes=1)
+    return lda_model
+
+def build_analysis(classification_counts, emotion_counts, top_topics, key_phrases, total_comments):
+    analysis = build_sentiment_section(classification_counts, total_comments)
+    analysis.update(build_topics_section(top_topics))
+    analysis.update(build_key_phrases_section(key_phrases))
+    analysis.update(build_emotions_section(emotion_counts))
+    logger.info("Visualizations created.")
+    return analysis
+
+def analyze_comments_with_model(comments, weights=None, return_details=False, on_stage=None, budget=None,
+                                topic_indices=None):
+    """
+    Runs the full analysis. Stages run cheapest first (sentiment, emotions, key
+    phrases, then the topic sweep and LDA); if on_stage is given it is called
+    with each section's name and result keys as soon as that stage finishes.
+    With a budget (profiles.AnalysisBudget), key phrases are skipped and the
+    topic sweep and passes reduced as needed to meet its deadline; the budget
+    records which sections are partial. When labeling every comment would not
+    fit, sentiment and emotions are estimated from a fixed-seed sample (the
+    details then hold None for unlabeled comments), and the OpenAI call is cut
+    off at the deadline. With a broker (distributed.py),
+    preprocessing, emotions and the topic sweep run on the workers. With
+    topic_indices, key phrases, the topic sweep and the LDA model use only
+    those comments (e.g. one per group of near-duplicates); every comment
+    still gets its topic distribution.
+    """
     try:
         logger.info("Starting comment analysis...")
 
-        processed_comments = [preprocess_text(comment) for comment in comments]
-        logger.info(f"Processed {len(processed_comments)} comments.")
-
-        tokenized_comments = [comment.split() for comment in processed_comments]
-        dictionary = corpora.Dictionary(tokenized_comments)
-        corpus = [dictionary.doc2bow(text) for text in tokenized_comments]
-        logger.info(f"Created dictionary with {len(dictionary)} tokens and corpus with {len(corpus)} documents.")
-
-        optimal_num_topics = determine_optimal_topics(processed_comments, dictionary, corpus)
-        logger.info(f"Optimal number of topics: {optimal_num_topics}")
-
-        lda_model = LdaModel(
-            corpus=corpus,
-            id2word=dictionary,
-            num_topics=optimal_num_topics,
-            random_state=42,
-            update_every=1,
-            chunksize=100,
-            passes=10,
-            alpha='auto',
-            per_word_topics=True
-        )
-        logger.info("LDA model trained.")
-
-        top_topics = []
-        for topic_idx in range(optimal_num_topics):
-            topic = lda_model.show_topic(topic_idx, topn=10)
-            words = [word for word, prob in topic]
-            top_topics.append({
-                'id': topic_idx,
-                'words': words,
-                'weight': float(sum([prob for word, prob in topic]))
-            })
-        logger.info("Top topics extracted.")
-
-        classifications = [classify_comment(comment) for comment in processed_comments]
-        classification_counts = Counter(classifications)
-        logger.info("Sentiment classification completed.")
-
-        summary = generate_summary(classification_counts, len(comments))
-
-        key_phrases = generate_key_phrases(comments)
-        logger.info("Key phrases generated using OpenAI.")
+        # Each comment may stand for several collapsed near-duplicates, or for
+        # part of its stratum when analyzing a sample.
+        if weights is None:
+            weights = [1] * len(comments)
+        total_comments = sum(weights)
+
+        def stage_done(name, section):
+            if on_stage:
+                on_stage(name, section)
+
+        labeled = budget.plan_labels(len(comments)) if budget else len(comments)
+        if labeled < len(comments):
+            # A fixed-seed sample, so repeated analyses label the same comments;
+            # its weights are scaled up to stand for every comment.
+            label_indices = np.sort(np.random.default_rng(42).choice(len(comments), labeled, replace=False)).tolist()
+            scale = total_comments / sum(weights[index] for index in label_indices)
+            label_weights = [weights[index] * scale for index in label_indices]
+        else:
+            label_indices, label_weights = list(range(len(comments))), weights
+        labeled_comments = [comments[index] for index in label_indices]
+
+        # Large analyses ship preprocessing and emotions to the workers, if any
+        preprocess_batch, emotions_batch = submit_comment_stages(comments, labeled_comments)
+        try:
+            with stage_timer('preprocess', len(comments)):
+                corpus = CompactCorpus.from_texts(run_comment_stage(
+                    preprocess_batch, comments, lambda comments: (preprocess_text(comment) for comment in comments),
+                    'preprocess', budget
+                ))
+            dictionary = corpus.dictionary
+            logger.info(f"Processed {len(corpus)} comments.")
+            logger.info(
+                f"Created dictionary with {len(dictionary)} tokens and corpus with {len(corpus)} documents "
+                f"({corpus.nbytes} bytes)."
+            )
 
+            with stage_timer('sentiment', len(label_indices)):
+                sentiment_scores = [get_sentiment_score(corpus.tokens(index)) for index in label_indices]
+            sentiments = [sentiment_label(score) for score in sentiment_scores]
+            classification_counts = Counter()
+            for sentiment, weight in zip(sentiments, label_weights):
+                classification_counts[sentiment] += weight
+            logger.info("Sentiment classification completed.")
+            stage_done('sentiment', build_sentiment_section(classification_counts, total_comments))
+
+            with stage_timer('emotions', len(labeled_comments)):
+                emotion_scores = run_comment_stage(
+                    emotions_batch, labeled_comments, lambda comments: [te.get_emotion(comment) for comment in comments],
+                    'emotions', budget
+                )
+        finally:
+            for batch in (preprocess_batch, emotions_batch):
+                if batch is not None:
+                    batch.cancel()
         emotion_counts = Counter()
-        for comment in comments:
-            emotions = te.get_emotion(comment)
+        for emotions, weight in zip(emotion_scores, label_weights):
             for emotion, score in emotions.items():
                 if score > 0:
-                    emotion_counts[emotion] += 1
+                    emotion_counts[emotion] += weight
         logger.info("Emotion analysis completed.")
+        stage_done('emotions', build_emotions_section(emotion_counts))
 
-        sentiment_chart = create_sentiment_chart(classification_counts)
-        topics_chart = create_topics_chart(top_topics)
-        emotion_chart = create_emotion_chart(emotion_counts)
-
-        logger.info("Visualizations created.")
+        if topic_indices is None:
+            topic_comments, topic_corpus = comments, corpus
+        else:
+            topic_comments, topic_corpus = [comments[index] for index in topic_indices], corpus.subset(topic_indices)
+
+        if budget and not budget.profile.key_phrases:
+            key_phrases = []
+            budget.mark_partial('key_phrases', f"not generated by the {budget.profile.name} profile")
+        elif budget and not budget.affords('key_phrases', 1, share=0.5):
+            key_phrases = []
+            budget.mark_partial('key_phrases', "skipped to meet the deadline")
+        else:
+            # Like the affordability check, leave half the time for the topics
+            timeout = budget.timeout(0.5) if budget else None
+            with stage_timer('key_phrases', 1):
+                key_phrases = generate_key_phrases(topic_comments, timeout=timeout)
+            if timeout is not None and not key_phrases:
+                budget.mark_partial('key_phrases', "not generated in time")
+            else:
+                logger.info("Key phrases generated using OpenAI.")
+        stage_done('key_phrases', build_key_phrases_section(key_phrases))
+
+        optimal_num_topics, passes = choose_num_topics(topic_corpus, budget)
+        logger.info(f"Optimal number of topics: {optimal_num_topics}")
 
-        classification_html = classification_html_func(classification_counts)
-        top_topics_html = topics_html_func(top_topics)
-        key_phrases_html = key_phrases_html_func(key_phrases)
+        lda_model = train_lda(topic_corpus, dictionary, optimal_num_topics, passes, budget)
+        logger.info("LDA model trained.")
 
-        return {
-            'summary': summary,
-            'classification': classification_html,
-            'top_topics': top_topics_html,
-            'key_phrases': key_phrases_html,
-            'sentiment_chart': sentiment_chart,
-            'topics_chart': topics_chart,
-            'emotion_chart': emotion_chart
-        }
+        top_topics = extract_top_topics(lda_model)
+        logger.info("Top topics extracted.")
+        stage_done('topics', build_topics_section(top_topics))
+
+        analysis = build_analysis(classification_counts, emotion_counts, top_topics, key_phrases, total_comments)
+        if return_details:
+            def by_comment(values):
+                spread = [None] * len(comments)
+                for index, value in zip(label_indices, values):
+                    spread[index] = value
+                return spread
+
+            details = {
+                'corpus': corpus,
+                'sentiment_scores': by_comment(sentiment_scores),
+                'sentiments': by_comment(sentiments),
+                'emotions': by_comment(emotion_scores),
+                'topics': [get_topic_distribution(lda_model, bow) for bow in corpus],
+                'classification_counts': classification_counts,
+                'emotion_counts': emotion_counts,
+                'key_phrases': key_phrases,
+                'lda_model': lda_model
+            }
+            return analysis, details
+        return analysis
 
     except Exception as e:
         logger.error(f"Error in analyze_comments_with_model: {str(e)}")
         logger.error(traceback.format_exc())
-        return None
+        return (None, None) if return_details else None
 
 def classification_html_func(classification_counts):
     try:
         html = "<ul>"
         for category, count in classification_counts.items():
             percentage = (count / sum(classification_counts.values())) * 100
-            html += f"<li><strong>{category}:</strong> {count} ({percentage:.1f}%)</li>"
+            html += f"<li><strong>{category}:</strong> {count:.0f} ({percentage:.1f}%)</li>"
         html += "</ul>"
         return html
     except Exception as e:
@@ -0,0 +1,227 @@
+import os
+import time
+import shutil
+import logging
+import threading
+import traceback
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+from search_index import write_inverted_index, load_inverted_index, evaluate_query
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are serialized per process only
+    fcntl = None
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+# Column store directory (one sub-directory per video, one per generation inside it)
+COLUMN_STORE_DIR = '.cache/columns'
+os.makedirs(COLUMN_STORE_DIR, exist_ok=True)
+
+SENTIMENT_LABELS = ('Positive', 'Negative', 'Neutral')
+EMOTIONS = ('Happy', 'Angry', 'Surprise', 'Sad', 'Fear')
+MAX_QUERY_LIMIT = 500
+MAX_OPEN_STORES = 32
+
+_open_stores = OrderedDict()
+_open_stores_lock = threading.Lock()
+_writer_locks = {}
+_writer_locks_lock = threading.Lock()
+
+def get_store_dir(video_id):
+    return os.path.join(COLUMN_STORE_DIR, video_id)
+
+@contextmanager
+def store_writer_lock(video_id):
+    """
+    Serializes writers of a video's columns across threads and worker processes.
+    """
+    with _writer_locks_lock:
+        thread_lock = _writer_locks.setdefault(video_id, threading.Lock())
+    with thread_lock, open(os.path.join(COLUMN_STORE_DIR, f'{video_id}.lock'), 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def write_blob(path, strings):
+    """
+    Writes strings as one UTF-8 blob and returns their (n + 1) byte offsets.
+    """
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    with open(path, 'wb') as f:
+        for index, value in enumerate(strings):
+            encoded = value.encode('utf-8')
+            f.write(encoded)
+            offsets[index + 1] = offsets[index] + len(encoded)
+    return offsets
+
+def write_comment_columns(video_id, records, results):
+    """
+    Writes per-comment results (records maps comment key -> record, results maps
+    comment key -> per-comment result) as memory-mappable columns:
+    ids and texts (UTF-8 blobs with offsets), sentiment score and label,
+    emotion scores and dominant topic. A new generation is written next to the
+    current one and then published by atomically replacing the CURRENT pointer;
+    only generations older than the published one are removed.
+    """
+    try:
+        store_dir = get_store_dir(video_id)
+        with store_writer_lock(video_id):
+            # Generations are named by creation time, so a newer one is never deleted
+            generation = f'{time.time_ns()}'
+            generation_dir = os.path.join(store_dir, generation)
+            os.makedirs(generation_dir)
+
+            keys = list(records)
+            rows = [results[key] for key in keys]
+            id_offsets = write_blob(os.path.join(generation_dir, 'ids.bin'), keys)
+            text_offsets = write_blob(os.path.join(generation_dir, 'text.bin'), [records[key]['text'] for key in keys])
+            np.save(os.path.join(generation_dir, 'id_offsets.npy'), id_offsets)
+            np.save(os.path.join(generation_dir, 'text_offsets.npy'), text_offsets)
+
+            np.save(
+                os.path.join(generation_dir, 'sentiment_score.npy'),
+                np.array([row.get('sentiment_score', 0.0) for row in rows], dtype=np.float32)
+            )
+            np.save(
+                os.path.join(generation_dir, 'sentiment_label.npy'),
+                np.array([SENTIMENT_LABELS.index(row['sentiment']) for row in rows], dtype=np.int8)
+            )
+            np.save(
+                os.path.join(generation_dir, 'emotions.npy'),
+                np.array([[row['emotions'].get(emotion, 0.0) for emotion in EMOTIONS] for row in rows],
+                         dtype=np.float32).reshape(len(rows), len(EMOTIONS))
+            )
+            np.save(
+                os.path.join(generation_dir, 'dominant_topic.npy'),
+                np.array([max(row['topics'], key=lambda topic: topic[1])[0] if row['topics'] else -1 for row in rows],
+                         dtype=np.int16)
+            )
+
+            write_inverted_index(generation_dir, [row.get('tokens', []) for row in rows])
+
+            pointer = os.path.join(store_dir, 'CURRENT')
+            with open(pointer + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(generation)
+            os.replace(pointer + '.tmp', pointer)
+
+            # Older generations can go: open memory maps keep their files alive.
+            for name in os.listdir(store_dir):
+                if name.isdigit() and int(name) < int(generation):
+                    shutil.rmtree(os.path.join(store_dir, name), ignore_errors=True)
+            logger.info(f"Comment columns written for video ID: {video_id} ({len(rows)} comments)")
+    except Exception as e:
+        logger.error(f"Error writing comment columns: {str(e)}")
+        logger.error(traceback.format_exc())
+
+def has_comment_columns(video_id):
+    return os.path.exists(os.path.join(get_store_dir(video_id), 'CURRENT'))
+
+def open_comment_columns(video_id):
+    """
+    Memory-maps the current generation of a video's columns, or returns None.
+    """
+    try:
+        return load_comment_columns(video_id)
+    except FileNotFoundError:
+        # A newer generation was published (and this one removed) while opening it
+        return load_comment_columns(video_id)
+
+def load_comment_columns(video_id):
+    store_dir = get_store_dir(video_id)
+    try:
+        with open(os.path.join(store_dir, 'CURRENT'), 'r', encoding='utf-8') as f:
+            generation = f.read().strip()
+    except FileNotFoundError:
+        return None
+
+    with _open_stores_lock:
+        cached = _open_stores.get(video_id)
+        if cached and cached['generation'] == generation:
+            _open_stores.move_to_end(video_id)
+            return cached
+
+    generation_dir = os.path.join(store_dir, generation)
+    columns = {'generation': generation}
+    for name in ('id_offsets', 'text_offsets', 'sentiment_score', 'sentiment_label', 'emotions', 'dominant_topic'):
+        columns[name] = np.load(os.path.join(generation_dir, f'{name}.npy'), mmap_mode='r')
+    for name in ('ids', 'text'):
+        path = os.path.join(generation_dir, f'{name}.bin')
+        columns[name] = np.memmap(path, dtype=np.uint8, mode='r') if os.path.getsize(path) else np.zeros(0, np.uint8)
+    columns['index'] = load_inverted_index(generation_dir)
+
+    with _open_stores_lock:
+        _open_stores[video_id] = columns
+        while len(_open_stores) > MAX_OPEN_STORES:
+            _open_stores.popitem(last=False)
+    return columns
+
+def read_blob_value(blob, offsets, index):
+    return bytes(blob[offsets[index]:offsets[index + 1]]).decode('utf-8')
+
+def get_comment_row(columns, index):
+    """
+    Decodes one comment (row) of the column store.
+    """
+    return {
+        'id': read_blob_value(columns['ids'], columns['id_offsets'], index),
+        'text': read_blob_value(columns['text'], columns['text_offsets'], index),
+        'sentiment_score': float(columns['sentiment_score'][index]),
+        'sentiment': SENTIMENT_LABELS[columns['sentiment_label'][index]],
+        'emotions': dict(zip(EMOTIONS, columns['emotions'][index].tolist())),
+        'dominant_topic': int(columns['dominant_topic'][index])
+    }
+
+def query_comments(video_id, sentiment=None, topic=None, emotion=None, min_emotion_score=0.0,
+                   offset=0, limit=50):
+    """
+    Filters a video's analyzed comments by sentiment label, dominant topic and
+    emotion, and returns one page of matches. Filtering runs on the memory-mapped
+    columns; only the returned page is decoded into Python objects.
+    """
+    columns = open_comment_columns(video_id)
+    if columns is None:
+        return None
+
+    mask = np.ones(len(columns['sentiment_label']), dtype=bool)
+    if sentiment is not None:
+        mask &= columns['sentiment_label'] == SENTIMENT_LABELS.index(sentiment)
+    if topic is not None:
+        mask &= columns['dominant_topic'] == topic
+    if emotion is not None:
+        mask &= columns['emotions'][:, EMOTIONS.index(emotion)] > min_emotion_score
+
+    matches = np.flatnonzero(mask)
+    page = matches[offset:offset + min(limit, MAX_QUERY_LIMIT)]
+    return {
+        'total': int(len(matches)),
+        'offset': offset,
+        'limit': limit,
+        'comments': [get_comment_row(columns, index) for index in page]
+    }
+
+def search_comments(video_id, query, offset=0, limit=50):
+    """
+    Keyword search over a video's analyzed comments using the inverted index
+    stored with its columns (see search_index.evaluate_query for the syntax).
+    """
+    columns = open_comment_columns(video_id)
+    if columns is None:
+        return None
+
+    matches = evaluate_query(columns['index'], query, len(columns['sentiment_label']))
+    page = matches[offset:offset + min(limit, MAX_QUERY_LIMIT)]
+    return {
+        'query': query,
+        'total': int(len(matches)),
+        'offset': offset,
+        'limit': limit,
+        'comments': [get_comment_row(columns, index) for index in page]
+    }
@@ -0,0 +1,116 @@
+import base64
+from array import array
+import numpy as np
+from gensim import corpora
+
+class TokenTexts:
+    """
+    Re-iterable view yielding each document as a list of tokens, for consumers
+    such as CoherenceModel that need texts rather than bags of words. Tokens are
+    the dictionary's own strings, so no new string objects are created.
+    """
+
+    def __init__(self, corpus):
+        self.corpus = corpus
+
+    def __len__(self):
+        return len(self.corpus)
+
+    def __iter__(self):
+        for index in range(len(self.corpus)):
+            yield self.corpus.tokens(index)
+
+class CompactCorpus:
+    """
+    CSR-style corpus: the tokens of document i, in order, are
+    token_ids[offsets[i]:offsets[i + 1]]. Built once from the preprocessed
+    comments and shared by every analysis stage. Iterating yields gensim
+    bags of words one document at a time, so it can be passed as an LDA corpus.
+    """
+
+    def __init__(self, token_ids, offsets, dictionary):
+        self.token_ids = token_ids
+        self.offsets = offsets
+        self.dictionary = dictionary
+        self.id2token = [None] * len(dictionary)
+        for token, token_id in dictionary.token2id.items():
+            self.id2token[token_id] = token
+
+    @classmethod
+    def from_texts(cls, processed_comments):
+        """
+        Builds the dictionary and the CSR arrays in a single pass over
+        preprocessed (space-joined) comments, which may be a generator.
+        """
+        dictionary = corpora.Dictionary()
+        token_ids = array('i')
+        offsets = array('q', [0])
+        for text in processed_comments:
+            tokens = text.split()
+            dictionary.doc2bow(tokens, allow_update=True)
+            token_ids.extend(dictionary.doc2idx(tokens))
+            offsets.append(len(token_ids))
+        return cls(
+            np.frombuffer(token_ids, dtype=np.int32) if token_ids else np.zeros(0, dtype=np.int32),
+            np.frombuffer(offsets, dtype=np.int64),
+            dictionary
+        )
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def document(self, index):
+        return self.token_ids[self.offsets[index]:self.offsets[index + 1]]
+
+    def tokens(self, index):
+        id2token = self.id2token
+        return [id2token[token_id] for token_id in self.document(index).tolist()]
+
+    def bow(self, index):
+        token_ids, counts = np.unique(self.document(index), return_counts=True)
+        return list(zip(token_ids.tolist(), counts.tolist()))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.bow(index)
+
+    def subset(self, indices):
+        """
+        A corpus of the given documents (in that order) sharing this dictionary.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        lengths = self.offsets[indices + 1] - self.offsets[indices]
+        token_ids = np.concatenate([self.document(index) for index in indices]) if len(indices) else self.token_ids[:0]
+        offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        return CompactCorpus(token_ids, offsets, self.dictionary)
+
+    def texts(self):
+        return TokenTexts(self)
+
+    def to_payload(self):
+        """
+        A JSON-serializable copy (token strings in id order, base64 CSR arrays)
+        for sending the corpus to distributed workers.
+        """
+        return {
+            'tokens': self.id2token,
+            'token_ids': base64.b64encode(self.token_ids.astype(np.int32).tobytes()).decode('ascii'),
+            'offsets': base64.b64encode(self.offsets.astype(np.int64).tobytes()).decode('ascii')
+        }
+
+    @classmethod
+    def from_payload(cls, payload):
+        """
+        Rebuilds a corpus from to_payload(), with a dictionary assigning the same ids.
+        """
+        dictionary = corpora.Dictionary()
+        dictionary.token2id = {token: token_id for token_id, token in enumerate(payload['tokens'])}
+        return cls(
+            np.frombuffer(base64.b64decode(payload['token_ids']), dtype=np.int32),
+            np.frombuffer(base64.b64decode(payload['offsets']), dtype=np.int64),
+            dictionary
+        )
+
+    @property
+    def nbytes(self):
+        return self.token_ids.nbytes + self.offsets.nbytes
@@ -0,0 +1,165 @@
+import re
+import zlib
+import logging
+import traceback
+import numpy as np
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+# MinHash / LSH parameters. With 16 bands of 4 rows, pairs with a Jaccard
+# similarity of about 0.5 have a 50% chance of becoming candidates and pairs
+# above 0.8 are almost always found; candidates are then verified against
+# SIMILARITY_THRESHOLD using the full signature.
+NUM_PERMUTATIONS = 64
+NUM_BANDS = 16
+SHINGLE_SIZE = 4
+SIMILARITY_THRESHOLD = 0.8
+
+_MERSENNE_PRIME = (1 << 31) - 1
+_rng = np.random.RandomState(42)
+_HASH_A = _rng.randint(1, _MERSENNE_PRIME, size=NUM_PERMUTATIONS).astype(np.uint64)
+_HASH_B = _rng.randint(0, _MERSENNE_PRIME, size=NUM_PERMUTATIONS).astype(np.uint64)
+
+def normalize_comment(text):
+    """
+    Normalizes a comment for duplicate detection (case, punctuation, whitespace).
+    """
+    text = re.sub(r'[^\w\s]', ' ', str(text).lower())
+    return ' '.join(text.split())
+
+def get_shingles(text, size=SHINGLE_SIZE):
+    """
+    Returns the set of hashed character shingles for a normalized comment.
+    """
+    if len(text) <= size:
+        return {zlib.crc32(text.encode('utf-8'))}
+    return {zlib.crc32(text[i:i + size].encode('utf-8')) for i in range(len(text) - size + 1)}
+
+def minhash_signature(shingles):
+    """
+    Computes the MinHash signature of a set of hashed shingles.
+    """
+    values = np.fromiter(shingles, dtype=np.uint64, count=len(shingles)) % _MERSENNE_PRIME
+    hashed = (np.outer(_HASH_A, values) + _HASH_B[:, None]) % _MERSENNE_PRIME
+    return hashed.min(axis=1)
+
+def _find(parents, index):
+    while parents[index] != index:
+        parents[index] = parents[parents[index]]
+        index = parents[index]
+    return index
+
+def collapse_near_duplicates(comments, threshold=SIMILARITY_THRESHOLD, return_groups=False):
+    """
+    Collapses exact and near-duplicate comments into weighted representatives.
+
+    Returns a tuple of (representatives, weights, stats) where each
+    representative is the first occurrence of its group and its weight is the
+    number of comments it stands for, so weighted counts match the input.
+    With return_groups, a fourth element maps every input comment to the
+    index of its representative.
+    """
+    try:
+        total = len(comments)
+        rows = NUM_PERMUTATIONS // NUM_BANDS
+
+        # Exact duplicates (after normalization) are grouped without hashing.
+        group_index = {}
+        members = []
+        member_of = []
+        for position, comment in enumerate(comments):
+            key = normalize_comment(comment) or str(comment).strip()
+            if key not in group_index:
+                group_index[key] = len(members)
+                members.append([position, 0, key])
+            members[group_index[key]][1] += 1
+            member_of.append(group_index[key])
+
+        signatures = [minhash_signature(get_shingles(key)) for _, _, key in members]
+
+        # LSH banding: every group lands in one bucket per band and is only
+        # compared with the first group of that bucket, keeping the pass linear.
+        parents = list(range(len(members)))
+        for band in range(NUM_BANDS):
+            buckets = {}
+            start, end = band * rows, (band + 1) * rows
+            for index, signature in enumerate(signatures):
+                bucket_key = signature[start:end].tobytes()
+                anchor = buckets.setdefault(bucket_key, index)
+                if anchor == index:
+                    continue
+                root_anchor, root_index = _find(parents, anchor), _find(parents, index)
+                if root_anchor == root_index:
+                    continue
+                similarity = float(np.mean(signatures[anchor] == signature))
+                if similarity >= threshold:
+                    parents[max(root_anchor, root_index)] = min(root_anchor, root_index)
+
+        weights_by_root = {}
+        for index, (_, count, _) in enumerate(members):
+            root = _find(parents, index)
+            weights_by_root[root] = weights_by_root.get(root, 0) + count
+
+        roots = sorted(weights_by_root)
+        representatives = [comments[members[root][0]] for root in roots]
+        weights = [weights_by_root[root] for root in roots]
+
+        stats = {
+            'total_comments': total,
+            'unique_comments': len(representatives),
+            'collapsed_comments': total - len(representatives),
+            'reduction_ratio': round(1 - len(representatives) / total, 4) if total else 0.0
+        }
+        logger.info(
+            f"Collapsed {stats['collapsed_comments']} near-duplicate comments "
+            f"({stats['reduction_ratio'] * 100:.1f}% reduction)."
+        )
+        if return_groups:
+            representative_index = {root: index for index, root in enumerate(roots)}
+            groups = [representative_index[_find(parents, member)] for member in member_of]
+            return representatives, weights, stats, groups
+        return representatives, weights, stats
+
+    except Exception as e:
+        logger.error(f"Error in collapse_near_duplicates: {str(e)}")
+        logger.error(traceback.format_exc())
+        stats = {
+            'total_comments': len(comments),
+            'unique_comments': len(comments),
+            'collapsed_comments': 0,
+            'reduction_ratio': 0.0
+        }
+        if return_groups:
+            return list(comments), [1] * len(comments), stats, list(range(len(comments)))
+        return list(comments), [1] * len(comments), stats
+
+def collapse_duplicates(comments, threshold=SIMILARITY_THRESHOLD):
+    """
+    Collapses duplicates for the analysis at two levels. Only exact duplicates
+    (after normalization) share labels: each is analyzed once and weighted by
+    its count. Near-duplicates can differ in meaning (a single "not" keeps two
+    comments above the threshold), so they are only collapsed for topic
+    modeling and key phrases.
+
+    Returns a tuple of (representatives, weights, stats, groups, topic_indices)
+    where groups maps every input comment to the index of its representative
+    and topic_indices selects one representative per near-duplicate group.
+    """
+    _, _, stats, near_groups = collapse_near_duplicates(comments, threshold, return_groups=True)
+    representatives = []
+    weights = []
+    groups = []
+    group_index = {}
+    topic_representatives = {}
+    for comment, near_group in zip(comments, near_groups):
+        key = normalize_comment(comment) or str(comment).strip()
+        if key not in group_index:
+            group_index[key] = len(representatives)
+            representatives.append(comment)
+            weights.append(0)
+        weights[group_index[key]] += 1
+        groups.append(group_index[key])
+        topic_representatives.setdefault(near_group, group_index[key])
+    stats = dict(stats, labeled_comments=len(representatives))
+    return representatives, weights, stats, groups, sorted(topic_representatives.values())
@@ -0,0 +1,569 @@
+"""
+Distributed execution of the heavy analysis stages.
+
+A coordinator (the web app) splits work into tasks on a broker queue:
+comment shards for preprocessing and emotion scoring, and one task per
+candidate topic count for the topic sweep. Stateless workers on any number of
+nodes pull tasks, run the same functions as a single-node analysis and return
+JSON results, which the coordinator merges in task order, so the output
+matches a single-node run.
+
+    python distributed.py broker --host 0.0.0.0 --port 8765
+    python distributed.py worker --broker http://broker-host:8765 --processes 4
+
+The app uses the broker named by ANALYSIS_BROKER_URL whenever workers are
+polling it, and runs everything locally otherwise (or if the broker fails).
+Broker is also the in-process stand-in: pass it to use_broker() and
+start_local_workers() to run the distributed path without any servers.
+"""
+import os
+import hmac
+import json
+import time
+import uuid
+import socket
+import logging
+import argparse
+import threading
+import traceback
+import multiprocessing
+import urllib.error
+import urllib.request
+from collections import deque, OrderedDict
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+# Broker used by the app (unset: single-node) and the optional shared secret
+# that the broker requires from coordinators and workers.
+BROKER_URL = os.getenv('ANALYSIS_BROKER_URL', '')
+BROKER_TOKEN = os.getenv('ANALYSIS_BROKER_TOKEN', '')
+
+# Comments per preprocessing/emotion task, and the analysis size below which
+# shipping comments around costs more than it saves.
+SHARD_SIZE = int(os.getenv('ANALYSIS_SHARD_SIZE', '250'))
+MIN_DISTRIBUTED_COMMENTS = int(os.getenv('ANALYSIS_MIN_DISTRIBUTED_COMMENTS', '1000'))
+# How long the coordinator waits for a batch before running it locally.
+TASK_TIMEOUT = float(os.getenv('ANALYSIS_TASK_TIMEOUT', '300'))
+
+# A task whose worker has not answered within the lease is handed to another
+# worker, at most MAX_ATTEMPTS times in all. Jobs nobody collects (e.g. their
+# coordinator died) are dropped after JOB_TTL.
+LEASE_TIMEOUT = float(os.getenv('BROKER_LEASE_TIMEOUT', '600'))
+JOB_TTL = float(os.getenv('BROKER_JOB_TTL', '3600'))
+MAX_ATTEMPTS = 3
+# Workers long-poll for tasks; one that has not polled for WORKER_TTL is gone.
+POLL_WAIT = 20.0
+WORKER_TTL = 60.0
+
+class DistributedError(Exception):
+    """
+    Raised when distributed work fails (broker unreachable, task error or
+    timeout); callers fall back to running the work locally.
+    """
+
+class Broker:
+    """
+    In-memory broker: a FIFO task queue with leases, per-job results and one
+    shared payload per job (e.g. the corpus every sweep task needs). Served
+    over HTTP by serve_broker; BrokerClient has the same methods.
+    """
+
+    def __init__(self, lease_timeout=LEASE_TIMEOUT, job_ttl=JOB_TTL):
+        self.lease_timeout = lease_timeout
+        self.job_ttl = job_ttl
+        self.pending = deque()
+        self.leased = {}
+        self.jobs = {}
+        self.workers = {}
+        self.completed = 0
+        self.failed = 0
+        self.requeued = 0
+        self.condition = threading.Condition()
+
+    def submit(self, job, kind, tasks, shared=None):
+        with self.condition:
+            self.jobs[job] = {'shared': shared, 'results': [], 'expires': time.time() + self.job_ttl}
+            self.pending.extend(
+                {'id': f'{job}-{index}', 'job': job, 'index': index, 'kind': kind, 'args': args, 'attempts': 0}
+                for index, args in enumerate(tasks)
+            )
+            self.condition.notify_all()
+
+    def _expire(self, now):
+        for job in [job for job, state in self.jobs.items() if state['expires'] < now]:
+            self.cancel(job)
+        for task_id, (task, expires) in list(self.leased.items()):
+            if expires >= now:
+                continue
+            del self.leased[task_id]
+            if task['job'] not in self.jobs:
+                continue
+            if task['attempts'] < MAX_ATTEMPTS:
+                self.pending.appendleft(task)
+                self.requeued += 1
+            else:
+                self._finish(task, {'error': f"no result after {task['attempts']} attempts"})
+
+    def _finish(self, task, outcome):
+        state = self.jobs.get(task['job'])
+        if state:
+            state['results'].append([task['index'], outcome])
+            self.condition.notify_all()
+
+    def lease(self, worker, wait=0.0):
+        """
+        Hands the next task to a worker, waiting up to `wait` seconds for one.
+        Returns None if there is none.
+        """
+        deadline = time.monotonic() + wait
+        with self.condition:
+            while True:
+                now = time.time()
+                self.workers[worker] = now
+                self._expire(now)
+                while self.pending:
+                    task = self.pending.popleft()
+                    state = self.jobs.get(task['job'])
+                    if state is None:
+                        continue
+                    task['attempts'] += 1
+                    self.leased[task['id']] = (task, now + self.lease_timeout)
+                    return {'id': task['id'], 'job': task['job'], 'kind': task['kind'], 'args': task['args'],
+                            'shared': state['shared'] is not None}
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(min(remaining, 5.0))
+
+    def release(self, task_id):
+        """
+        Puts a leased task back at the head of the queue (its worker never got it).
+        """
+        with self.condition:
+            entry = self.leased.pop(task_id, None)
+            if entry is not None:
+                entry[0]['attempts'] -= 1
+                self.pending.appendleft(entry[0])
+                self.condition.notify_all()
+
+    def get_shared(self, job):
+        with self.condition:
+            state = self.jobs.get(job)
+            return state['shared'] if state else None
+
+    def complete(self, task_id, result=None, error=None):
+        """
+        Records a task's result (or error). Late answers for tasks that were
+        re-leased to another worker, or whose job was cancelled, are dropped.
+        """
+        with self.condition:
+            entry = self.leased.pop(task_id, None)
+            if entry is None:
+                return False
+            if error is not None:
+                self.failed += 1
+                self._finish(entry[0], {'error': error})
+            else:
+                self.completed += 1
+                self._finish(entry[0], {'result': result})
+            return True
+
+    def collect(self, job, wait=0.0):
+        """
+        Returns the [index, outcome] pairs finished since the last call, waiting
+        up to `wait` seconds for at least one, or None if the job is unknown.
+        """
+        deadline = time.monotonic() + wait
+        with self.condition:
+            while True:
+                state = self.jobs.get(job)
+                if state is None:
+                    return None
+                if state['results']:
+                    results, state['results'] = state['results'], []
+                    return results
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self.condition.wait(remaining)
+
+    def cancel(self, job):
+        with self.condition:
+            if self.jobs.pop(job, None) is not None:
+                self.pending = deque(task for task in self.pending if task['job'] != job)
+
+    def live_workers(self):
+        with self.condition:
+            now = time.time()
+            for worker in [worker for worker, seen in self.workers.items() if now - seen > WORKER_TTL]:
+                del self.workers[worker]
+            return len(self.workers)
+
+    def stats(self):
+        live_workers = self.live_workers()
+        with self.condition:
+            return {
+                'workers': live_workers,
+                'jobs': len(self.jobs),
+                'pending': len(self.pending),
+                'leased': len(self.leased),
+                'completed': self.completed,
+                'failed': self.failed,
+                'requeued': self.requeued
+            }
+
+class BrokerHandler(BaseHTTPRequestHandler):
+    """
+    JSON over HTTP for Broker:
+    - POST   /jobs/<job>          {kind, tasks, shared}
+    - GET    /jobs/<job>/shared
+    - GET    /jobs/<job>/results?wait=<seconds>
+    - DELETE /jobs/<job>
+    - POST   /lease               {worker, wait}
+    - POST   /tasks/<id>/result   {result} or {error}
+    - GET    /stats
+    """
+    protocol_version = 'HTTP/1.1'
+    broker = None
+    token = ''
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def route(self):
+        """
+        Returns the path segments and query, or None after answering 401.
+        """
+        if self.token and not hmac.compare_digest(self.headers.get('Authorization', ''), f'Bearer {self.token}'):
+            self.send_json(401, {'error': 'unauthorized'})
+            return None
+        url = urlparse(self.path)
+        return [part for part in url.path.split('/') if part], parse_qs(url.query)
+
+    def do_GET(self):
+        routed = self.route()
+        if routed is None:
+            return
+        parts, query = routed
+        if parts == ['stats']:
+            return self.send_json(200, self.broker.stats())
+        if len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'shared':
+            shared = self.broker.get_shared(parts[1])
+            return self.send_json(200, shared) if shared is not None else self.send_json(404, {'error': 'unknown job'})
+        if len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'results':
+            wait = min(float(query.get('wait', ['0'])[0]), POLL_WAIT)
+            results = self.broker.collect(parts[1], wait=wait)
+            return self.send_json(200, results) if results is not None else self.send_json(404, {'error': 'unknown job'})
+        self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        routed = self.route()
+        if routed is None:
+            return
+        parts, _ = routed
+        try:
+            body = self.read_json()
+        except ValueError:
+            return self.send_json(400, {'error': 'invalid JSON'})
+        if len(parts) == 2 and parts[0] == 'jobs':
+            self.broker.submit(parts[1], body['kind'], body['tasks'], body.get('shared'))
+            return self.send_json(200, {})
+        if parts == ['lease']:
+            task = self.broker.lease(body['worker'], wait=min(float(body.get('wait', 0)), POLL_WAIT))
+            try:
+                return self.send_json(200, {'task': task})
+            except OSError:
+                # The worker hung up while polling (e.g. it was stopped)
+                if task:
+                    self.broker.release(task['id'])
+                return
+        if len(parts) == 3 and parts[0] == 'tasks' and parts[2] == 'result':
+            accepted = self.broker.complete(parts[1], result=body.get('result'), error=body.get('error'))
+            return self.send_json(200, {'accepted': accepted})
+        self.send_json(404, {'error': 'not found'})
+
+    def do_DELETE(self):
+        routed = self.route()
+        if routed is None:
+            return
+        parts, _ = routed
+        if len(parts) == 2 and parts[0] == 'jobs':
+            self.broker.cancel(parts[1])
+            return self.send_json(200, {})
+        self.send_json(404, {'error': 'not found'})
+
+def serve_broker(broker, host='127.0.0.1', port=0, token=BROKER_TOKEN):
+    """
+    Serves a Broker over HTTP in a daemon thread and returns (server, base_url).
+    """
+    handler = type('BrokerHandler', (BrokerHandler,), {'broker': broker, 'token': token})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='broker', daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}'
+
+class BrokerClient:
+    """
+    A remote broker, with the same methods as Broker. Failures raise DistributedError.
+    """
+
+    def __init__(self, url, token=BROKER_TOKEN, timeout=30.0):
+        self.url = url.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+
+    def request(self, method, path, payload=None, timeout=None):
+        """
+        Sends a JSON request and returns the decoded reply, or None on 404.
+        """
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        req = urllib.request.Request(self.url + path, data=data, method=method, headers=headers)
+        try:
+            with urllib.request.urlopen(req, timeout=timeout or self.timeout) as response:
+                return json.loads(response.read() or b'null')
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise DistributedError(f"Broker returned HTTP {e.code} for {method} {path}")
+        except (OSError, ValueError) as e:
+            raise DistributedError(f"Broker request {method} {path} failed: {str(e)}")
+
+    def submit(self, job, kind, tasks, shared=None):
+        self.request('POST', f'/jobs/{job}', {'kind': kind, 'tasks': tasks, 'shared': shared})
+
+    def lease(self, worker, wait=0.0):
+        reply = self.request('POST', '/lease', {'worker': worker, 'wait': wait}, timeout=wait + self.timeout)
+        return reply['task'] if reply else None
+
+    def get_shared(self, job):
+        return self.request('GET', f'/jobs/{job}/shared')
+
+    def complete(self, task_id, result=None, error=None):
+        payload = {'error': error} if error is not None else {'result': result}
+        reply = self.request('POST', f'/tasks/{task_id}/result', payload)
+        return bool(reply and reply['accepted'])
+
+    def collect(self, job, wait=0.0):
+        return self.request('GET', f'/jobs/{job}/results?wait={wait:.3f}', timeout=wait + self.timeout)
+
+    def cancel(self, job):
+        self.request('DELETE', f'/jobs/{job}')
+
+    def live_workers(self):
+        return self.stats()['workers']
+
+    def stats(self):
+        return self.request('GET', '/stats', timeout=5.0)
+
+class Batch:
+    """
+    The tasks of one job; results() merges them back in task order.
+    """
+
+    def __init__(self, broker, job, kind, count):
+        self.broker = broker
+        self.job = job
+        self.kind = kind
+        self.count = count
+        self.cancelled = False
+
+    def results(self, timeout=TASK_TIMEOUT, partial=False):
+        """
+        Waits for every task and returns their results in order. Raises
+        DistributedError if a task fails or the timeout passes first, unless
+        partial is set: then missing results are None.
+        """
+        results = [None] * self.count
+        received = set()
+        deadline = time.monotonic() + timeout
+        try:
+            while len(received) < self.count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    if partial:
+                        return results
+                    raise DistributedError(f"{self.count - len(received)} of {self.count} {self.kind} tasks timed out")
+                finished = self.broker.collect(self.job, wait=min(remaining, POLL_WAIT))
+                if finished is None:
+                    raise DistributedError(f"{self.kind} job is no longer on the broker")
+                for index, outcome in finished:
+                    if 'error' in outcome:
+                        raise DistributedError(f"{self.kind} task failed: {outcome['error']}")
+                    results[index] = outcome['result']
+                    received.add(index)
+            return results
+        finally:
+            self.cancel()
+
+    def cancel(self):
+        if self.cancelled:
+            return
+        self.cancelled = True
+        try:
+            self.broker.cancel(self.job)
+        except DistributedError as e:
+            logger.warning(f"Error cancelling {self.kind} job: {str(e)}")
+
+class Coordinator:
+    """
+    Submits jobs to the broker on behalf of the analysis.
+    """
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def available(self):
+        """
+        True if workers are polling the broker.
+        """
+        try:
+            return self.broker.live_workers() > 0
+        except DistributedError as e:
+            logger.warning(f"Broker unavailable, analyzing locally: {str(e)}")
+            return False
+
+    def submit(self, kind, tasks, shared=None):
+        job = uuid.uuid4().hex
+        self.broker.submit(job, kind, tasks, shared)
+        return Batch(self.broker, job, kind, len(tasks))
+
+    def stats(self):
+        try:
+            return self.broker.stats()
+        except DistributedError as e:
+            return {'error': str(e)}
+
+_coordinator = Coordinator(BrokerClient(BROKER_URL)) if BROKER_URL else None
+
+def get_coordinator():
+    """
+    The coordinator for the configured broker, or None in single-node mode.
+    """
+    return _coordinator
+
+def use_broker(broker):
+    """
+    Switches the analysis to a broker (a Broker or BrokerClient; None: single-node).
+    """
+    global _coordinator
+    _coordinator = Coordinator(broker) if broker is not None else None
+
+def run_worker(broker, tasks=None, worker_id=None, stop=None, poll_wait=POLL_WAIT):
+    """
+    Pulls tasks from the broker and runs them until stop (a threading.Event)
+    is set. tasks maps task kinds to functions(args, shared) returning
+    JSON-serializable results (default: comment_analysis.WORKER_TASKS).
+    """
+    if tasks is None:
+        from comment_analysis import WORKER_TASKS as tasks
+    worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}'
+    stop = stop or threading.Event()
+    # Shared payloads of recent jobs, so each is fetched once per worker
+    shared_cache = OrderedDict()
+    logger.info(f"Worker {worker_id} polling for tasks")
+    while not stop.is_set():
+        try:
+            task = broker.lease(worker_id, wait=poll_wait)
+            if task is None:
+                continue
+            shared = None
+            if task['shared']:
+                shared = shared_cache.get(task['job'])
+                if shared is None:
+                    shared = broker.get_shared(task['job'])
+                    if shared is not None:
+                        shared_cache[task['job']] = shared
+                        while len(shared_cache) > 4:
+                            shared_cache.popitem(last=False)
+            try:
+                result = tasks[task['kind']](task['args'], shared)
+            except Exception as e:
+                logger.error(f"Error running {task['kind']} task: {str(e)}")
+                logger.error(traceback.format_exc())
+                broker.complete(task['id'], error=str(e) or type(e).__name__)
+                continue
+            broker.complete(task['id'], result=result)
+        except DistributedError as e:
+            logger.warning(f"{str(e)}; retrying in 5s")
+            stop.wait(5)
+
+def start_local_workers(broker, count, tasks=None, poll_wait=1.0):
+    """
+    Runs workers in threads of this process (the stand-in for worker nodes)
+    and returns the event that stops them.
+    """
+    stop = threading.Event()
+    for index in range(count):
+        threading.Thread(
+            target=run_worker, args=(broker, tasks, f'local-{os.getpid()}-{index}', stop, poll_wait),
+            name=f'analysis-worker-{index}', daemon=True
+        ).start()
+    return stop
+
+def run_worker_process(broker_url, token=BROKER_TOKEN):
+    run_worker(BrokerClient(broker_url, token))
+
+def start_worker_processes(broker_url, count, token=BROKER_TOKEN):
+    """
+    Starts worker processes for a broker URL and returns them. They are not
+    daemonic, because the coherence model may start processes of its own.
+    """
+    processes = []
+    for index in range(count):
+        process = multiprocessing.Process(
+            target=run_worker_process, args=(broker_url, token), name=f'analysis-worker-{index}'
+        )
+        process.start()
+        processes.append(process)
+    return processes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    broker_parser = subparsers.add_parser('broker', help='Run the task broker.')
+    broker_parser.add_argument('--host', default='127.0.0.1', help='Use 0.0.0.0 to accept workers on other nodes.')
+    broker_parser.add_argument('--port', type=int, default=8765)
+    worker_parser = subparsers.add_parser('worker', help='Run analysis workers.')
+    worker_parser.add_argument('--broker', default=BROKER_URL, help='Broker URL (default: ANALYSIS_BROKER_URL).')
+    worker_parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == 'broker':
+        _, url = serve_broker(Broker(), args.host, args.port)
+        print(f"ANALYSIS_BROKER_URL={url}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+    else:
+        if not args.broker:
+            parser.error('--broker or ANALYSIS_BROKER_URL is required')
+        processes = start_worker_processes(args.broker, args.processes)
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+
+if __name__ == '__main__':
+    main()
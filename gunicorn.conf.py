@@ -0,0 +1,48 @@
+"""
+Production serving: gunicorn -c gunicorn.conf.py main:app
+
+The master process imports the app and warms up every NLP resource once, then
+forks the workers, which share those pages copy-on-write.
+
+Graceful restarts:
+- kill -HUP <master>   replaces workers one by one after they finish their
+                       in-flight requests (configuration is re-read).
+- kill -USR2 <master>  starts a new master with the new code alongside the old
+  then -WINCH/-QUIT    one, for zero-downtime upgrades.
+"""
+import os
+import logging
+
+bind = os.getenv('WEB_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_WORKERS', '4'))
+worker_class = 'gthread'
+# Requests waiting in the admission queues (admission.py) hold a thread, so keep
+# threads above ANALYZE_MAX_ACTIVE + ANALYZE_MAX_QUEUE or cheap requests can be
+# stuck behind queued analyses before reaching the light lane.
+threads = int(os.getenv('WEB_THREADS', '8'))
+timeout = int(os.getenv('WEB_TIMEOUT', '300'))
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', '60'))
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.getenv('WEB_MAX_REQUESTS_JITTER', '100'))
+preload_app = True
+
+logger = logging.getLogger('gunicorn.error')
+
+def when_ready(server):
+    # Runs in the master after the app has been preloaded, before any fork.
+    from warmup import warm_up_models, get_memory_usage
+    warm_up_models()
+    server.warmup_memory = get_memory_usage()
+    logger.info(f"Master warmed up before forking: {server.warmup_memory}")
+
+def post_worker_init(worker):
+    from warmup import get_memory_usage
+    from refresher import start_refresher
+    from main import refresh_watched_video
+    logger.info(f"Worker {worker.pid} ready: {get_memory_usage()}")
+    # Every worker starts the refresher thread; only the one holding its lock works
+    start_refresher(refresh_watched_video)
+
+def worker_exit(server, worker):
+    from warmup import get_memory_usage
+    logger.info(f"Worker {worker.pid} exiting after serving requests: {get_memory_usage()}")
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import traceback
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from openai_api import generate_ai_image
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+# Generated images, named by the SHA-256 of their content, plus one small job
+# file per prompt so every worker process sees the same status.
+IMAGE_DIR = '.cache/images'
+IMAGE_JOB_DIR = os.path.join(IMAGE_DIR, 'jobs')
+os.makedirs(IMAGE_JOB_DIR, exist_ok=True)
+
+# Total size of stored images; the least recently served are evicted beyond it.
+MAX_STORE_BYTES = int(float(os.getenv('AI_IMAGE_STORE_MAX_MB', '200')) * 1024 * 1024)
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+# A pending job older than this (e.g. its worker died) is started again.
+PENDING_TIMEOUT = 300
+# Job files not updated for this long are deleted, unless their image is still stored.
+JOB_RETENTION = 24 * 3600
+
+# Image generation and download happen off the request path, a few at a time.
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='ai-image')
+_store_lock = threading.Lock()
+
+def get_image_id(summary):
+    return hashlib.sha1(summary.encode('utf-8')).hexdigest()
+
+def get_job_file_path(image_id):
+    return os.path.join(IMAGE_JOB_DIR, f'{image_id}.json')
+
+def get_image_url(filename):
+    return f'/images/{filename}'
+
+def load_job(image_id):
+    try:
+        with open(get_job_file_path(image_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_job(image_id, job):
+    path = get_job_file_path(image_id)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(dict(job, updated=time.time()), f)
+    os.replace(path + '.tmp', path)
+
+def job_status(image_id, job):
+    """
+    The client-facing status of a job: pending, ready (with the image URL) or
+    failed. A ready job whose image was evicted has no status (None).
+    """
+    if job['status'] == 'ready':
+        if not os.path.exists(os.path.join(IMAGE_DIR, job['filename'])):
+            return None
+        return {'image_id': image_id, 'status': 'ready', 'url': get_image_url(job['filename'])}
+    return {'image_id': image_id, 'status': job['status'], 'url': None}
+
+def store_image(data):
+    """
+    Writes image bytes under their content hash and returns the file name.
+    """
+    filename = hashlib.sha256(data).hexdigest() + '.png'
+    path = os.path.join(IMAGE_DIR, filename)
+    if not os.path.exists(path):
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+    else:
+        os.utime(path)
+    evict_images()
+    return filename
+
+def evict_images():
+    """
+    Deletes the least recently served images until the store fits MAX_STORE_BYTES.
+    """
+    with _store_lock:
+        images = []
+        for entry in os.scandir(IMAGE_DIR):
+            if entry.is_file() and entry.name.endswith('.png'):
+                stat = entry.stat()
+                images.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in images)
+        for _, size, path in sorted(images):
+            if total <= MAX_STORE_BYTES:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                logger.info(f"Evicted AI image {os.path.basename(path)}")
+            except OSError:
+                pass
+
+def prune_job_files():
+    """
+    Deletes the job files last updated over JOB_RETENTION ago, except ready
+    jobs whose image is still stored (their file is the only way to find it).
+    """
+    cutoff = time.time() - JOB_RETENTION
+    for entry in os.scandir(IMAGE_JOB_DIR):
+        try:
+            if not entry.is_file() or not entry.name.endswith('.json') or entry.stat().st_mtime >= cutoff:
+                continue
+            job = load_job(entry.name[:-len('.json')])
+            if job and job['status'] == 'ready' and os.path.exists(os.path.join(IMAGE_DIR, job['filename'])):
+                continue
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+def download_image(url):
+    with urllib.request.urlopen(url, timeout=30) as response:
+        data = response.read(MAX_IMAGE_BYTES + 1)
+    if len(data) > MAX_IMAGE_BYTES:
+        raise ValueError('Generated image is too large.')
+    return data
+
+def run_image_job(image_id, summary):
+    try:
+        image_url = generate_ai_image(summary)
+        if not image_url:
+            save_job(image_id, {'status': 'failed'})
+            return
+        # OpenAI image URLs expire, so keep our own copy
+        filename = store_image(download_image(image_url))
+        save_job(image_id, {'status': 'ready', 'filename': filename})
+        logger.info(f"AI image {image_id} stored as {filename}")
+    except Exception as e:
+        logger.error(f"Error generating AI image: {str(e)}")
+        logger.error(traceback.format_exc())
+        save_job(image_id, {'status': 'failed'})
+
+def request_ai_image(summary):
+    """
+    Returns the status of the AI image for a summary, starting its generation
+    in the background unless it is stored or already being generated. Poll
+    get_image_status with the returned image_id until it is ready or failed.
+    """
+    image_id = get_image_id(summary)
+    with _store_lock:
+        job = load_job(image_id)
+        if job:
+            status = job_status(image_id, job)
+            fresh = time.time() - job['updated'] < PENDING_TIMEOUT
+            if status and (status['status'] == 'ready' or (status['status'] == 'pending' and fresh)):
+                return status
+        save_job(image_id, {'status': 'pending'})
+    prune_job_files()
+    _executor.submit(run_image_job, image_id, summary)
+    return {'image_id': image_id, 'status': 'pending', 'url': None}
+
+def get_image_status(image_id):
+    """
+    Returns the status of an image job, or None if it is unknown (or its image was evicted).
+    """
+    job = load_job(image_id)
+    return job_status(image_id, job) if job else None
+
+def touch_image(filename):
+    """
+    Marks a stored image as recently served, so eviction keeps it longer.
+    """
+    try:
+        os.utime(os.path.join(IMAGE_DIR, filename))
+    except OSError:
+        pass
@@ -0,0 +1,330 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from gensim.models import LdaModel
+import text2emotion as te
+from comment_analysis import (
+    preprocess_text, get_sentiment_score, sentiment_label, get_topic_distribution,
+    extract_top_topics, build_analysis, analyze_comments_with_model
+)
+from dedup import collapse_duplicates
+from openai_api import generate_key_phrases
+from comment_store import write_comment_columns, has_comment_columns
+from rollups import update_rollups
+
+try:
+    import fcntl
+except ImportError:  # Windows: analyses are serialized per process only
+    fcntl = None
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+# Analysis cache directory (one sub-directory per video)
+ANALYSIS_CACHE_DIR = '.cache/analysis'
+os.makedirs(ANALYSIS_CACHE_DIR, exist_ok=True)
+
+# Retrain from scratch when the delta is large relative to what is stored, so
+# the topic count and vocabulary do not drift too far from a fresh sweep.
+FULL_REBUILD_RATIO = 0.5
+# Regenerate key phrases (an OpenAI call) only after this share of comments changed.
+KEY_PHRASE_REFRESH_RATIO = 0.2
+# Online updates shift the topics, so stored comments' topic distributions (and
+# /comments?topic= filters) are re-inferred after this share of comments was
+# folded into the model.
+TOPIC_REFRESH_RATIO = 0.2
+
+_video_locks = {}
+_video_locks_lock = threading.Lock()
+
+@contextmanager
+def get_video_lock(video_id):
+    """
+    Serializes the load -> update -> save of a video's analysis state across
+    threads and worker processes, so no reader sees a half-written model and
+    concurrent deltas do not overwrite each other.
+    """
+    with _video_locks_lock:
+        thread_lock = _video_locks.setdefault(video_id, threading.Lock())
+    with thread_lock, open(os.path.join(ANALYSIS_CACHE_DIR, f'{video_id}.lock'), 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def comment_key(record):
+    """
+    Returns the key per-comment results are stored under: the YouTube comment id,
+    or a hash of the text for records cached before ids were kept.
+    """
+    if record.get('id'):
+        return record['id']
+    return 'sha1:' + hashlib.sha1(record['text'].encode('utf-8')).hexdigest()
+
+def get_analysis_dir(video_id):
+    return os.path.join(ANALYSIS_CACHE_DIR, video_id)
+
+def has_analysis_state(video_id):
+    analysis_dir = get_analysis_dir(video_id)
+    return os.path.exists(os.path.join(analysis_dir, 'state.json')) and os.path.exists(os.path.join(analysis_dir, 'lda.model'))
+
+def is_reduced_analysis_state(video_id):
+    """
+    True if the stored state was built under a reduced budget, so the next
+    unbounded analysis rebuilds it (a full analysis). Reads only the small
+    meta file written next to the state.
+    """
+    analysis_dir = get_analysis_dir(video_id)
+    try:
+        with open(os.path.join(analysis_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            return bool(json.load(f).get('reduced'))
+    except FileNotFoundError:
+        # States saved before the meta file existed
+        try:
+            with open(os.path.join(analysis_dir, 'state.json'), 'r', encoding='utf-8') as f:
+                return bool(json.load(f).get('reduced'))
+        except (OSError, ValueError):
+            return False
+    except (OSError, ValueError):
+        return False
+
+def load_analysis_state(video_id):
+    """
+    Loads the stored per-comment results and LDA model for a video, if any.
+    """
+    try:
+        analysis_dir = get_analysis_dir(video_id)
+        state_file = os.path.join(analysis_dir, 'state.json')
+        model_file = os.path.join(analysis_dir, 'lda.model')
+        if os.path.exists(state_file) and os.path.exists(model_file):
+            with open(state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            state['classification_counts'] = Counter(state['classification_counts'])
+            state['emotion_counts'] = Counter(state['emotion_counts'])
+            return state, LdaModel.load(model_file)
+    except Exception as e:
+        logger.error(f"Error loading analysis state: {str(e)}")
+    return None, None
+
+def save_analysis_state(video_id, state, lda_model):
+    """
+    Persists per-comment results and the LDA model for a video.
+    """
+    try:
+        analysis_dir = get_analysis_dir(video_id)
+        os.makedirs(analysis_dir, exist_ok=True)
+        lda_model.save(os.path.join(analysis_dir, 'lda.model'))
+        state_file = os.path.join(analysis_dir, 'state.json')
+        with open(state_file + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(state_file + '.tmp', state_file)
+        meta_file = os.path.join(analysis_dir, 'meta.json')
+        with open(meta_file + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'reduced': bool(state.get('reduced'))}, f)
+        os.replace(meta_file + '.tmp', meta_file)
+        logger.info(f"Analysis state saved for video ID: {video_id}")
+    except Exception as e:
+        logger.error(f"Error saving analysis state: {str(e)}")
+
+def apply_comment_result(state, result, sign):
+    """
+    Adds (sign=1) or removes (sign=-1) one comment's labels from the aggregated counters.
+    """
+    state['classification_counts'][result['sentiment']] += sign
+    for emotion, score in result['emotions'].items():
+        if score > 0:
+            state['emotion_counts'][emotion] += sign
+    for counts in (state['classification_counts'], state['emotion_counts']):
+        for label in [label for label, count in counts.items() if count <= 0]:
+            del counts[label]
+
+def full_analysis(records, on_stage=None, budget=None):
+    """
+    Analyzes every comment and returns a fresh state plus the trained LDA model.
+    A state built under a deadline remembers whether its topic model was
+    reduced, and skipped key phrases are generated on the next refresh.
+    Comments left unlabeled to meet a deadline are not stored, so the next
+    refresh labels them as new comments.
+    """
+    texts = [record['text'] for record in records]
+    unique_comments, weights, dedup_stats, groups, topic_indices = collapse_duplicates(texts)
+    analysis, details = analyze_comments_with_model(
+        unique_comments, weights=weights, return_details=True, on_stage=on_stage, budget=budget,
+        topic_indices=topic_indices
+    )
+    if not analysis:
+        return None, None, None
+
+    comments = {}
+    for record, group in zip(records, groups):
+        if details['sentiments'][group] is None:
+            continue
+        comments[comment_key(record)] = {
+            'tokens': details['corpus'].tokens(group),
+            'sentiment_score': details['sentiment_scores'][group],
+            'sentiment': details['sentiments'][group],
+            'emotions': details['emotions'][group],
+            'topics': details['topics'][group]
+        }
+    state = {
+        'comments': comments,
+        'classification_counts': details['classification_counts'],
+        'emotion_counts': details['emotion_counts'],
+        'key_phrases': details['key_phrases'],
+        'changes_since_key_phrases': len(records) if budget and 'key_phrases' in budget.partial else 0,
+        'changes_since_topics': 0,
+        'reduced': bool(budget and budget.reduced)
+    }
+    if len(comments) < len(records):
+        # The analysis estimated its counts from a sample; the state counts
+        # only what it stores.
+        state['classification_counts'], state['emotion_counts'] = Counter(), Counter()
+        for result in comments.values():
+            apply_comment_result(state, result, 1)
+    return state, details['lda_model'], dedup_stats
+
+def label_new_comments(records, lda_model):
+    """
+    Computes per-comment results for new comments only, folding them into the
+    existing LDA model with an online update. Words outside the model's
+    vocabulary are ignored.
+    """
+    texts = [record['text'] for record in records]
+    unique_comments, _, dedup_stats, groups, topic_indices = collapse_duplicates(texts)
+
+    tokenized_comments = [preprocess_text(comment).split() for comment in unique_comments]
+    bows = [lda_model.id2word.doc2bow(tokens) for tokens in tokenized_comments]
+    known_bows = [bows[index] for index in topic_indices if bows[index]]
+    if known_bows:
+        lda_model.update(known_bows)
+        logger.info(f"LDA model updated with {len(known_bows)} new documents.")
+
+    results = []
+    for comment, tokens, bow in zip(unique_comments, tokenized_comments, bows):
+        score = get_sentiment_score(tokens)
+        results.append({
+            'tokens': tokens,
+            'sentiment_score': score,
+            'sentiment': sentiment_label(score),
+            'emotions': te.get_emotion(comment),
+            'topics': get_topic_distribution(lda_model, bow) if bow else []
+        })
+    return [results[group] for group in groups], dedup_stats
+
+def reinfer_topics(state, lda_model):
+    """
+    Recomputes every stored comment's topic distribution with the current model.
+    """
+    for result in state['comments'].values():
+        bow = lda_model.id2word.doc2bow(result['tokens'])
+        result['topics'] = get_topic_distribution(lda_model, bow) if bow else []
+    logger.info(f"Topic distributions of {len(state['comments'])} comments re-inferred.")
+
+def analyze_video_comments(video_id, records, on_stage=None, budget=None):
+    """
+    Analyzes a video's comments, reusing stored per-comment results so that a
+    refresh only processes comments that were not analyzed before. on_stage and
+    budget are passed on to a full analysis (see analyze_comments_with_model);
+    incremental refreshes are fast enough to return everything at once. A
+    topic model reduced to meet a deadline is rebuilt by the next analysis
+    without one.
+    """
+    try:
+        with get_video_lock(video_id):
+            state, lda_model = load_analysis_state(video_id)
+            current = {comment_key(record): record for record in records}
+
+            new_records = []
+            removed_keys = []
+            if state is not None:
+                new_records = [record for key, record in current.items() if key not in state['comments']]
+                removed_keys = [key for key in state['comments'] if key not in current]
+
+            unbounded = budget is None or budget.unbounded
+            if (state is None or len(new_records) > FULL_REBUILD_RATIO * max(len(state['comments']), 1)
+                    or (state.get('reduced') and unbounded)):
+                logger.info(f"Running full analysis for video ID: {video_id}")
+                state, lda_model, dedup_stats = full_analysis(list(current.values()), on_stage=on_stage, budget=budget)
+                if state is None:
+                    return None
+                new_count, reused_count = len(state['comments']), 0
+                changed = True
+            else:
+                logger.info(
+                    f"Incremental analysis for video ID {video_id}: "
+                    f"{len(new_records)} new, {len(removed_keys)} removed comments."
+                )
+                changed = bool(new_records or removed_keys)
+                for key in removed_keys:
+                    apply_comment_result(state, state['comments'].pop(key), -1)
+
+                dedup_stats = None
+                if new_records:
+                    results, dedup_stats = label_new_comments(new_records, lda_model)
+                    for record, result in zip(new_records, results):
+                        state['comments'][comment_key(record)] = result
+                        apply_comment_result(state, result, 1)
+
+                state['changes_since_topics'] = state.get('changes_since_topics', 0) + len(new_records)
+                if state['changes_since_topics'] > TOPIC_REFRESH_RATIO * len(current):
+                    # Roughly one inference pass over the stored comments
+                    if budget and not budget.affords('lda', len(state['comments'])):
+                        logger.info(f"Topic re-inference for video ID {video_id} deferred to meet the deadline.")
+                    else:
+                        reinfer_topics(state, lda_model)
+                        state['changes_since_topics'] = 0
+
+                state['changes_since_key_phrases'] += len(new_records) + len(removed_keys)
+                if state['changes_since_key_phrases'] > KEY_PHRASE_REFRESH_RATIO * len(current):
+                    if budget and not budget.profile.key_phrases:
+                        budget.mark_partial('key_phrases', f"not refreshed by the {budget.profile.name} profile")
+                    elif budget and not budget.affords('key_phrases', 1, share=0.5):
+                        budget.mark_partial('key_phrases', "not refreshed, to meet the deadline")
+                    else:
+                        timeout = budget.timeout(0.5) if budget else None
+                        key_phrases = generate_key_phrases([record['text'] for record in records], timeout=timeout)
+                        if timeout is not None and not key_phrases:
+                            budget.mark_partial('key_phrases', "not refreshed in time")
+                        else:
+                            state['key_phrases'] = key_phrases
+                            state['changes_since_key_phrases'] = 0
+                            changed = True
+                new_count, reused_count = len(new_records), len(current) - len(new_records)
+
+            # Any change rewrites the whole state, every column and the index
+            # (O(N) I/O however small the delta); a refresh without changes
+            # keeps them, so searches do not reopen the index either.
+            if changed or not has_comment_columns(video_id):
+                # Comments left unlabeled by a deadline-bound analysis wait for the next refresh
+                stored = {key: record for key, record in current.items() if key in state['comments']}
+                save_analysis_state(video_id, state, lda_model)
+                write_comment_columns(video_id, stored, state['comments'])
+                update_rollups(video_id, stored, state['comments'])
+            else:
+                logger.info(f"No changes for video ID {video_id}; stored analysis reused.")
+
+        analysis = build_analysis(
+            state['classification_counts'], state['emotion_counts'],
+            extract_top_topics(lda_model), state['key_phrases'], len(state['comments'])
+        )
+        if dedup_stats:
+            analysis['dedup_stats'] = dedup_stats
+        analysis['incremental_stats'] = {
+            'new_comments': new_count,
+            'reused_comments': reused_count,
+            'removed_comments': len(removed_keys)
+        }
+        return analysis
+
+    except Exception as e:
+        logger.error(f"Error in analyze_video_comments: {str(e)}")
+        logger.error(traceback.format_exc())
+        return None
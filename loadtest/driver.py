@@ -0,0 +1,159 @@
+"""
+Concurrent load driver for /analyze.
+
+By default it starts the YouTube and OpenAI stand-in servers, points the real
+Flask app at them (YOUTUBE_API_BASE_URL / OPENAI_API_BASE), serves the app
+in-process from a scratch working directory (so caches start cold), and then
+runs increasing concurrency levels, reporting throughput, p50/p95/p99
+latency and error rates:
+
+    python loadtest/driver.py --concurrency 1 2 4 8 --requests 40 --videos 10
+
+All requests come from 127.0.0.1, so the in-process app runs without the
+per-client rate limit (--rate-per-minute) and with lane queues deep enough
+for the highest concurrency (--queue), measuring throughput and latency
+rather than 429s. Active analyses keep the app's limits.
+
+Use --target http://host:port to drive an already running deployment instead
+(that deployment must be configured to use the stand-ins itself).
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+LOADTEST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(LOADTEST_DIR)
+sys.path.insert(0, LOADTEST_DIR)
+
+from stub_servers import (
+    YouTubeStubHandler, OpenAIStubHandler, start_stub_server, add_stub_arguments, configs_from_arguments
+)
+
+def start_app(youtube_url, openai_url, keep_cache=False, rate_per_minute=0, queue=16, queue_timeout=600.0):
+    """
+    Configures the environment for the stand-ins and the admission limits
+    (rate limit per client, queue depth of both lanes and queue timeout),
+    imports the Flask app and serves it with a threaded WSGI server. Returns
+    the app's base URL.
+    """
+    os.environ['ANALYZE_RATE_PER_MINUTE'] = str(rate_per_minute)
+    os.environ['ANALYZE_MAX_QUEUE'] = str(queue)
+    os.environ['ANALYZE_LIGHT_MAX_QUEUE'] = str(queue)
+    os.environ['ANALYZE_QUEUE_TIMEOUT'] = str(queue_timeout)
+    os.environ['YOUTUBE_API_KEY'] = 'stub-key'
+    os.environ['YOUTUBE_API_BASE_URL'] = youtube_url
+    os.environ['OPENAI_API_KEY'] = 'stub-key'
+    os.environ['OPENAI_API_BASE'] = f'{openai_url}/v1'
+    if not keep_cache:
+        os.chdir(tempfile.mkdtemp(prefix='loadtest-'))
+    sys.path.insert(0, REPO_DIR)
+
+    from werkzeug.serving import make_server
+    from main import app
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+def post_analyze(target, video_id, timeout):
+    body = urllib.parse.urlencode({'video_url': f'https://www.youtube.com/watch?v={video_id}'}).encode('utf-8')
+    request = urllib.request.Request(f'{target}/analyze', data=body, method='POST')
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        status = e.code
+    except Exception:
+        status = None
+    return time.perf_counter() - started, status
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def run_level(target, concurrency, requests, videos, timeout, offset):
+    """
+    Sends `requests` analyses with `concurrency` in flight, cycling through
+    `videos` video ids. Returns the level's statistics.
+    """
+    video_ids = [f'loadtest{(offset + i) % videos:05d}' for i in range(requests)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda video_id: post_analyze(target, video_id, timeout), video_ids))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in results)
+    statuses = {}
+    for _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    errors = sum(count for status, count in statuses.items() if status != '200')
+    return {
+        'concurrency': concurrency,
+        'requests': requests,
+        'throughput_rps': requests / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'error_rate': errors / requests if requests else 0.0,
+        'statuses': statuses
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', help='Base URL of a running app (default: serve the app in-process).')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--requests', type=int, default=20, help='Requests per concurrency level.')
+    parser.add_argument('--videos', type=int, default=10, help='Distinct video ids to cycle through.')
+    parser.add_argument('--timeout', type=float, default=600.0, help='Per-request timeout in seconds.')
+    parser.add_argument('--keep-cache', action='store_true', help='Use the current directory for caches.')
+    parser.add_argument('--json', help='Write the results to this file as JSON.')
+    parser.add_argument('--rate-per-minute', type=float, default=0,
+                        help='Per-client analyses per minute of the in-process app (default: 0, unlimited).')
+    parser.add_argument('--queue', type=int,
+                        help='Queue depth of both lanes of the in-process app (default: the highest concurrency).')
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    youtube_config, openai_config = configs_from_arguments(args)
+    target = args.target
+    if not target:
+        _, youtube_url = start_stub_server(YouTubeStubHandler, youtube_config)
+        _, openai_url = start_stub_server(OpenAIStubHandler, openai_config)
+        target = start_app(
+            youtube_url, openai_url, keep_cache=args.keep_cache, rate_per_minute=args.rate_per_minute,
+            queue=args.queue if args.queue is not None else max(args.concurrency), queue_timeout=args.timeout
+        )
+
+    print(f"{'conc':>5} {'reqs':>5} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}  statuses")
+    results = []
+    offset = 0
+    for concurrency in args.concurrency:
+        level = run_level(target, concurrency, args.requests, args.videos, args.timeout, offset)
+        offset += args.requests
+        results.append(level)
+        print(f"{level['concurrency']:>5} {level['requests']:>5} {level['throughput_rps']:>8.2f} "
+              f"{level['p50_ms']:>9.1f} {level['p95_ms']:>9.1f} {level['p99_ms']:>9.1f} "
+              f"{level['error_rate']:>6.1%}  {level['statuses']}")
+
+    if not args.target:
+        print(f"Stand-in calls: YouTube {youtube_config.requests} ({youtube_config.errors} injected errors), "
+              f"OpenAI {openai_config.requests} ({openai_config.errors} injected errors)")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
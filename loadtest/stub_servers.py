@@ -0,0 +1,246 @@
+"""
+Local stand-ins for the YouTube Data API and the OpenAI API, for load tests.
+
+- GET  /youtube/v3/commentThreads   paginated comment threads (with inline replies,
+                                    ETag / If-None-Match -> 304)
+- GET  /youtube/v3/videos           video statistics (commentCount)
+- POST /v1/chat/completions         a fixed list of key phrases
+- POST /v1/images/generations       a URL served by GET /images/<name>.png
+
+Latency and error injection are configurable per server. Run standalone with
+    python loadtest/stub_servers.py --youtube-port 8081 --openai-port 8082
+"""
+import json
+import time
+import zlib
+import hashlib
+import random
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+WORDS = (
+    'great video love the audio editing music camera lighting tutorial thanks bad boring '
+    'amazing sound voice helpful confusing slow fast funny sad angry happy first nice'
+).split()
+
+# A 1x1 transparent PNG.
+PNG_PIXEL = bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+    '1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082'
+)
+
+class StubConfig:
+    """
+    Latency (seconds, mean and uniform jitter) and error injection settings.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=500,
+                 comments_per_video=500, replies_per_thread=2, new_comments_per_minute=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.comments_per_video = comments_per_video
+        self.replies_per_thread = replies_per_thread
+        self.new_comments_per_minute = new_comments_per_minute
+        self.started = int(time.time())
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def total_comments(self):
+        # Threads grow by new_comments_per_minute since the server started.
+        return self.comments_per_video + int((time.time() - self.started) / 60 * self.new_comments_per_minute)
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def simulate(self):
+        """
+        Sleeps for the configured latency and returns True if this request
+        should fail.
+        """
+        config = self.config
+        delay = config.latency + random.uniform(-config.jitter, config.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        failed = random.random() < config.error_rate
+        with config.lock:
+            config.requests += 1
+            config.errors += failed
+        if failed:
+            self.send_json(config.error_status, {'error': {'code': config.error_status, 'message': 'Injected error'}})
+        return failed
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+def make_comment(video_id, index, published):
+    rng = random.Random(zlib.crc32(f'{video_id}:{index}'.encode('utf-8')))
+    return {
+        'id': f'{video_id}.{index}',
+        'snippet': {
+            'textDisplay': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 25))),
+            'authorDisplayName': f'user{rng.randint(1, 1000)}',
+            'authorChannelId': {'value': f'UC{rng.randint(1, 1000):06d}'},
+            'likeCount': rng.randint(0, 50),
+            'publishedAt': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(published))
+        }
+    }
+
+def comment_threads_page(config, video_id, page_token, max_results):
+    """
+    Builds one page of a deterministic comment thread listing (newest first).
+    Comments are a minute apart; the initial ones predate the server start.
+    """
+    total = config.total_comments()
+    start = int(page_token or 0)
+    end = min(start + max_results, total)
+    items = []
+    for index in range(start, end):
+        number = total - index
+        published = config.started + (number - config.comments_per_video) * 60
+        thread = {
+            'id': f'{video_id}.{number}',
+            'snippet': {'topLevelComment': make_comment(video_id, number, published)}
+        }
+        if config.replies_per_thread:
+            thread['replies'] = {'comments': [
+                make_comment(video_id, f'{number}.{reply}', published + reply + 1)
+                for reply in range(config.replies_per_thread)
+            ]}
+        items.append(thread)
+    page = {'kind': 'youtube#commentThreadListResponse', 'items': items}
+    if end < total:
+        page['nextPageToken'] = str(end)
+    page['etag'] = hashlib.sha1(json.dumps(page, sort_keys=True).encode('utf-8')).hexdigest()
+    return page
+
+class YouTubeStubHandler(StubHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/youtube/v3/videos':
+            if self.simulate():
+                return
+            query = parse_qs(url.query)
+            comment_count = self.config.total_comments() * (1 + self.config.replies_per_thread)
+            return self.send_json(200, {'kind': 'youtube#videoListResponse', 'items': [
+                {'id': video_id, 'statistics': {'commentCount': str(comment_count)}}
+                for video_id in query.get('id', [''])[0].split(',') if video_id
+            ]})
+        if url.path != '/youtube/v3/commentThreads':
+            return self.send_json(404, {'error': {'code': 404, 'message': 'Not found'}})
+        if self.simulate():
+            return
+        query = parse_qs(url.query)
+        video_id = query.get('videoId', [''])[0]
+        max_results = int(query.get('maxResults', ['20'])[0])
+        page_token = query.get('pageToken', [None])[0]
+        page = comment_threads_page(self.config, video_id, page_token, max_results)
+        if self.headers.get('If-None-Match') == page['etag']:
+            self.send_response(304)
+            self.send_header('ETag', page['etag'])
+            self.send_header('Content-Length', '0')
+            return self.end_headers()
+        self.send_json(200, page, headers={'ETag': page['etag']})
+
+class OpenAIStubHandler(StubHandler):
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        self.read_body()
+        if url.path == '/v1/chat/completions':
+            if self.simulate():
+                return
+            phrases = '\n'.join(f'{i + 1}. {WORDS[i]} {WORDS[i + 1]}' for i in range(20))
+            return self.send_json(200, {
+                'id': 'chatcmpl-stub',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': 'gpt-3.5-turbo',
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': phrases}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+            })
+        if url.path == '/v1/images/generations':
+            if self.simulate():
+                return
+            host = self.headers.get('Host')
+            return self.send_json(200, {
+                'created': int(time.time()),
+                'data': [{'url': f'http://{host}/images/{random.getrandbits(64):016x}.png'}]
+            })
+        self.send_json(404, {'error': {'code': 404, 'message': 'Not found'}})
+
+    def do_GET(self):
+        if not self.path.startswith('/images/'):
+            return self.send_json(404, {'error': {'code': 404, 'message': 'Not found'}})
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(PNG_PIXEL)))
+        self.end_headers()
+        self.wfile.write(PNG_PIXEL)
+
+def start_stub_server(handler_class, config, host='127.0.0.1', port=0):
+    """
+    Starts a stub server in a daemon thread and returns (server, base_url).
+    """
+    handler = type(handler_class.__name__, (handler_class,), {'config': config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}'
+
+def add_stub_arguments(parser):
+    parser.add_argument('--youtube-latency', type=float, default=0.05, help='Seconds per YouTube page.')
+    parser.add_argument('--openai-latency', type=float, default=0.5, help='Seconds per OpenAI call.')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Uniform latency jitter in seconds.')
+    parser.add_argument('--youtube-error-rate', type=float, default=0.0)
+    parser.add_argument('--openai-error-rate', type=float, default=0.0)
+    parser.add_argument('--comments-per-video', type=int, default=500)
+    parser.add_argument('--new-comments-per-minute', type=float, default=0.0,
+                        help='Rate at which the stand-in threads grow.')
+
+def configs_from_arguments(args):
+    youtube = StubConfig(args.youtube_latency, args.jitter, args.youtube_error_rate,
+                         comments_per_video=args.comments_per_video,
+                         new_comments_per_minute=args.new_comments_per_minute)
+    openai = StubConfig(args.openai_latency, args.jitter, args.openai_error_rate)
+    return youtube, openai
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--youtube-port', type=int, default=8081)
+    parser.add_argument('--openai-port', type=int, default=8082)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    youtube_config, openai_config = configs_from_arguments(args)
+    _, youtube_url = start_stub_server(YouTubeStubHandler, youtube_config, port=args.youtube_port)
+    _, openai_url = start_stub_server(OpenAIStubHandler, openai_config, port=args.openai_port)
+    print(f"YOUTUBE_API_BASE_URL={youtube_url}")
+    print(f"OPENAI_API_BASE={openai_url}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
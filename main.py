@@ -1,11 +1,26 @@
 import os
+import re
+import math
 import json
+import queue
 import logging
+import threading
 import traceback
-from flask import Flask, render_template, request, jsonify
-from youtube_api import get_video_comments, get_video_id
-from comment_analysis import analyze_comments_with_model
-from openai_api import generate_ai_image
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory
+from youtube_api import get_video_comment_records, get_video_id, get_comment_count, has_fresh_cache, quota_budget
+from incremental_analysis import analyze_video_comments, has_analysis_state, is_reduced_analysis_state
+from admission import AdmissionController, Rejected
+from comment_store import query_comments, search_comments, SENTIMENT_LABELS, EMOTIONS
+from rollups import query_timeline, parse_timestamp
+from sampling import (
+    analyze_comments_approximately, approximate_fetch_size, get_refinement_status,
+    DEFAULT_MARGIN, DEFAULT_CONFIDENCE
+)
+from refresher import record_request, start_refresher, get_refresher_status
+from profiles import AnalysisBudget, get_profile, PROFILES
+from distributed import get_coordinator
+from image_store import request_ai_image, get_image_status, touch_image, IMAGE_DIR
+from comment_analysis import ANALYSIS_SECTIONS
 
 app = Flask(__name__)
 
@@ -19,34 +34,201 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Bounded analysis lanes and per-client rate limiting (configured from ANALYZE_* env vars)
+admission = AdmissionController.from_env()
+
+def rejected_response(rejection):
+    logger.warning(f"Rejected /analyze request from {request.remote_addr}: {rejection.reason}")
+    response = jsonify({
+        'error': 'Too many requests. Please try again later.',
+        'reason': rejection.reason,
+        'retry_after': rejection.retry_after
+    })
+    return response, 429, {'Retry-After': str(rejection.retry_after)}
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+class AnalysisError(Exception):
+    """
+    A failed analysis with the message and HTTP status to report to the client.
+    """
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+def run_analysis(video_url, video_id, approximate, margin, confidence, refine, budget, on_stage=None):
+    """
+    Fetches and analyzes a video's comments (the caller holds an admission slot)
+    within the request's budget. on_stage receives result sections as they
+    become ready (full analyses only).
+    """
+    if approximate:
+        # Fetch a pool of comment records sized from the target sample (with caching)
+        comment_count = get_comment_count(video_url)
+        records = get_video_comment_records(
+            video_url, max_results=approximate_fetch_size(comment_count, margin, confidence), include_replies=True
+        )
+        if not records:
+            raise AnalysisError('No comments fetched. Please ensure the video has comments enabled.', 400)
+
+        # Analyze a stratified sample of the comments
+        analysis = analyze_comments_approximately(
+            records, margin=margin, confidence=confidence, refine=refine, budget=budget, thread_comments=comment_count
+        )
+    else:
+        # Fetch comments (with caching)
+        records = get_video_comment_records(video_url, max_results=500)
+        if not records:
+            raise AnalysisError('No comments fetched. Please ensure the video has comments enabled.', 400)
+
+        # Analyze comments, reusing stored results for comments seen before
+        analysis = analyze_video_comments(video_id, records, on_stage=on_stage, budget=budget)
+    if not analysis:
+        raise AnalysisError('Failed to analyze comments.', 500)
+    # Profile, deadline, time taken and the sections that are partial
+    analysis['profile'] = budget.report()
+    return analysis
+
+def stream_analysis(video_id, analyze, release):
+    """
+    Streams an analysis as NDJSON: one {"stage", "data"} object per line for
+    each result section as soon as it is ready (sentiment, emotions, key
+    phrases, topics), then the remaining statistics, the AI image status and "done".
+    Failures are reported as {"stage": "error", "error": ...}. The analysis runs
+    in a background thread, which calls release() once the slot is no longer needed.
+    """
+    chunks = queue.Queue()
+
+    def worker():
+        streamed = set()
+
+        def on_stage(name, section):
+            streamed.add(name)
+            chunks.put({'stage': name, 'data': section})
+
+        try:
+            try:
+                analysis = analyze(on_stage)
+            finally:
+                release()
+
+            # Incremental and approximate analyses return their sections all at once
+            section_keys = set()
+            for name, keys in ANALYSIS_SECTIONS:
+                section_keys.update(keys)
+                if name not in streamed:
+                    chunks.put({'stage': name, 'data': {key: analysis[key] for key in keys if key in analysis}})
+            chunks.put({'stage': 'stats', 'data': {key: value for key, value in analysis.items() if key not in section_keys}})
+
+            # The image is generated in the background; the client polls /ai-image/<image_id>
+            ai_image = request_ai_image(analysis.get('summary', ''))
+            chunks.put({'stage': 'image', 'data': {'ai_image': ai_image, 'ai_image_url': ai_image['url'] or ''}})
+            chunks.put({'stage': 'done', 'data': {}})
+            logger.info(f"Analysis streamed for video ID: {video_id}")
+        except AnalysisError as e:
+            chunks.put({'stage': 'error', 'error': e.message})
+        except Exception as e:
+            error_message = f"An unexpected error occurred: {str(e)}"
+            logger.error(error_message)
+            logger.error(traceback.format_exc())
+            chunks.put({'stage': 'error', 'error': error_message})
+        finally:
+            chunks.put(None)
+
+    threading.Thread(target=worker, daemon=True).start()
+
+    def generate():
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                return
+            yield json.dumps(chunk) + '\n'
+
+    # Ask proxies (e.g. nginx) not to buffer the stream
+    return Response(generate(), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def refresh_watched_video(video_id):
+    """
+    Background refresher task: revalidates a watched video's comments and
+    updates its stored analysis, so user requests for it stay warm hits.
+    Runs in the heavy lane like any other analysis.
+    """
+    video_url = f'https://www.youtube.com/watch?v={video_id}'
+    with admission.slot('heavy'):
+        records = get_video_comment_records(video_url, max_results=500, refresh=True)
+        if not records:
+            return False
+        return analyze_video_comments(video_id, records) is not None
+
 @app.route('/analyze', methods=['POST'])
 def analyze():
     video_url = request.form.get('video_url', '').strip()
     if not video_url:
         return jsonify({'error': 'No YouTube URL provided.'}), 400
+    approximate = request.form.get('mode', '').strip().lower() == 'approximate'
+    # Clients sending "Accept: application/x-ndjson" get each section as soon as it is ready
+    stream = 'application/x-ndjson' in request.headers.get('Accept', '')
+
+    # The latency budget starts with the request
+    profile = get_profile(request.form.get('profile'))
+    if profile is None:
+        return jsonify({'error': f"Invalid profile. Use one of: {', '.join(PROFILES)}."}), 400
+    try:
+        deadline = float(request.form['deadline']) if request.form.get('deadline') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid deadline.'}), 400
+    if deadline is not None and not (math.isfinite(deadline) and deadline > 0):
+        return jsonify({'error': 'Deadline must be a positive number of seconds.'}), 400
+    budget = AnalysisBudget(profile, deadline)
 
     try:
+        admission.check_rate(request.remote_addr)
+
         video_id = get_video_id(video_url)
         if not video_id:
             return jsonify({'error': 'Invalid YouTube URL.'}), 400
+        record_request(video_id)
 
-        # Fetch comments (with caching)
-        comments = get_video_comments(video_url, max_results=500)
-        if not comments:
-            return jsonify({'error': 'No comments fetched. Please ensure the video has comments enabled.'}), 400
+        margin = confidence = refine = None
+        if approximate:
+            try:
+                margin = float(request.form.get('margin', DEFAULT_MARGIN))
+                confidence = float(request.form.get('confidence', DEFAULT_CONFIDENCE))
+            except ValueError:
+                return jsonify({'error': 'Invalid margin or confidence.'}), 400
+            if not (0 < margin < 1 and 0 < confidence < 1):
+                return jsonify({'error': 'Margin and confidence must be between 0 and 1.'}), 400
+            refine = request.form.get('refine', '').strip().lower() in ('1', 'true', 'yes')
+
+        # Re-serving cached comments with stored analysis state is cheap, so
+        # those requests take the light lane instead of queueing behind LDA
+        # sweeps; a reduced state is rebuilt by an unbounded request, which is heavy
+        cheap = (not approximate and has_fresh_cache(video_id) and has_analysis_state(video_id)
+                 and not (budget.unbounded and is_reduced_analysis_state(video_id)))
+        lane = 'light' if cheap else 'heavy'
+
+        if stream:
+            release = admission.admit(lane)
+            return stream_analysis(
+                video_id,
+                lambda on_stage: run_analysis(
+                    video_url, video_id, approximate, margin, confidence, refine, budget, on_stage
+                ),
+                release
+            )
 
-        # Analyze comments
-        analysis = analyze_comments_with_model(comments)
-        if not analysis:
-            return jsonify({'error': 'Failed to analyze comments.'}), 500
+        with admission.slot(lane):
+            analysis = run_analysis(video_url, video_id, approximate, margin, confidence, refine, budget)
 
-        # Generate AI image based on summary
-        ai_image_url = generate_ai_image(analysis.get('summary', ''))
-        analysis['ai_image_url'] = ai_image_url or ''
+        # Generate AI image based on summary in the background (poll /ai-image/<image_id>)
+        ai_image = request_ai_image(analysis.get('summary', ''))
+        analysis['ai_image'] = ai_image
+        analysis['ai_image_url'] = ai_image['url'] or ''
 
         # Include visualization data in the response
         visualization_data = {
@@ -60,12 +242,105 @@ def analyze():
 
         return jsonify(analysis)
 
+    except Rejected as e:
+        return rejected_response(e)
+    except AnalysisError as e:
+        return jsonify({'error': e.message}), e.status
     except Exception as e:
         error_message = f"An unexpected error occurred: {str(e)}"
         logger.error(error_message)
         logger.error(traceback.format_exc())
         return jsonify({'error': error_message}), 500
 
+@app.route('/ai-image/<image_id>', methods=['GET'])
+def ai_image_status(image_id):
+    status = get_image_status(image_id) if re.fullmatch(r'[0-9a-f]{40}', image_id) else None
+    if status is None:
+        return jsonify({'error': 'Unknown AI image.'}), 404
+    return jsonify(status)
+
+@app.route('/images/<filename>', methods=['GET'])
+def stored_image(filename):
+    if not re.fullmatch(r'[0-9a-f]{64}\.png', filename):
+        return jsonify({'error': 'Unknown image.'}), 404
+    touch_image(filename)
+    # Images are stored under their content hash, so they never change
+    return send_from_directory(os.path.abspath(IMAGE_DIR), filename, mimetype='image/png', max_age=31536000)
+
+@app.route('/metrics/refresher', methods=['GET'])
+def refresher_metrics():
+    return jsonify(get_refresher_status())
+
+@app.route('/metrics/admission', methods=['GET'])
+def admission_metrics():
+    return jsonify(admission.stats())
+
+@app.route('/metrics/quota', methods=['GET'])
+def quota_metrics():
+    return jsonify(quota_budget.stats())
+
+@app.route('/metrics/distributed', methods=['GET'])
+def distributed_metrics():
+    coordinator = get_coordinator()
+    if coordinator is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, 'broker': coordinator.stats()})
+
+@app.route('/analyze/refinement/<job_id>', methods=['GET'])
+def refinement_status(job_id):
+    status = get_refinement_status(job_id) if re.fullmatch(r'[0-9a-f]{32}', job_id) else None
+    if status is None:
+        return jsonify({'error': 'Unknown refinement job.'}), 404
+    return jsonify(status)
+
+@app.route('/comments/<video_id>', methods=['GET'])
+def comments(video_id):
+    sentiment = request.args.get('sentiment')
+    emotion = request.args.get('emotion')
+    if sentiment is not None and sentiment not in SENTIMENT_LABELS:
+        return jsonify({'error': f"Invalid sentiment. Use one of: {', '.join(SENTIMENT_LABELS)}."}), 400
+    if emotion is not None and emotion not in EMOTIONS:
+        return jsonify({'error': f"Invalid emotion. Use one of: {', '.join(EMOTIONS)}."}), 400
+    topic = request.args.get('topic', type=int)
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = min(500, max(1, request.args.get('limit', 50, type=int)))
+
+    result = query_comments(video_id, sentiment=sentiment, topic=topic, emotion=emotion, offset=offset, limit=limit)
+    if result is None:
+        return jsonify({'error': 'No analyzed comments for this video. Analyze it first.'}), 404
+    return jsonify(result)
+
+@app.route('/search/<video_id>', methods=['GET'])
+def search(video_id):
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'No search query provided.'}), 400
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = min(500, max(1, request.args.get('limit', 50, type=int)))
+
+    result = search_comments(video_id, query, offset=offset, limit=limit)
+    if result is None:
+        return jsonify({'error': 'No analyzed comments for this video. Analyze it first.'}), 404
+    return jsonify(result)
+
+@app.route('/timeline/<video_id>', methods=['GET'])
+def timeline(video_id):
+    bucket = request.args.get('bucket', 3600, type=int)
+    start = parse_timestamp(request.args.get('start'))
+    end = parse_timestamp(request.args.get('end'))
+    if (request.args.get('start') and start is None) or (request.args.get('end') and end is None):
+        return jsonify({'error': 'Invalid start or end. Use ISO 8601 or epoch seconds.'}), 400
+    if bucket <= 0:
+        return jsonify({'error': 'Bucket size must be positive.'}), 400
+
+    try:
+        result = query_timeline(video_id, bucket, start=start, end=end)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if result is None:
+        return jsonify({'error': 'No timeline for this video. Analyze it first.'}), 404
+    return jsonify(result)
+
 if __name__ == '__main__':
     # Ensure environment variables are set
     required_env_vars = ['OPENAI_API_KEY', 'YOUTUBE_API_KEY']
@@ -74,4 +349,8 @@ if __name__ == '__main__':
         logger.error(f"Missing environment variables: {', '.join(missing_vars)}")
         exit(1)
 
+    # With the debug reloader, only the serving child process refreshes
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_refresher(refresh_watched_video)
+
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -9,6 +9,10 @@ logger = logging.getLogger(__name__)
 # Configure OpenAI API key
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
+# Optional API base override (e.g. a local stand-in server for load tests)
+if os.getenv('OPENAI_API_BASE'):
+    openai.api_base = os.getenv('OPENAI_API_BASE')
+
 def generate_ai_image(summary):
     """
     Generates an AI image based on the provided summary using OpenAI's DALL·E API.
@@ -38,9 +42,10 @@ def generate_ai_image(summary):
         logger.error(traceback.format_exc())
     return None
 
-def generate_key_phrases(comments):
+def generate_key_phrases(comments, timeout=None):
     """
-    Generates key phrases from comments using OpenAI's API.
+    Generates key phrases from comments using OpenAI's API, giving up after
+    timeout seconds if one is given.
     """
     try:
         if not openai.api_key:
@@ -67,6 +72,7 @@ def generate_key_phrases(comments):
             n=1,
             stop=None,
             temperature=0.5,
+            request_timeout=timeout,
         )
 
         key_phrases_text = response.choices[0].message['content'].strip()
@@ -0,0 +1,206 @@
+import os
+import math
+import time
+import logging
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+# Named analysis profiles. topic_start/topic_limit bound the coherence sweep,
+# passes applies to every LDA fit, sweep_sample caps the documents the sweep
+# runs on (None: all), key_phrases enables the OpenAI key phrase call and
+# deadline is the default latency budget in seconds (None: no deadline).
+AnalysisProfile = namedtuple(
+    'AnalysisProfile', 'name topic_start topic_limit passes sweep_sample key_phrases deadline'
+)
+
+PROFILES = {
+    'fast': AnalysisProfile('fast', 2, 5, 3, 150, False, 5.0),
+    'balanced': AnalysisProfile('balanced', 2, 8, 5, 300, True, 15.0),
+    'thorough': AnalysisProfile('thorough', 2, 10, 10, None, True, None)
+}
+DEFAULT_PROFILE = os.getenv('ANALYSIS_PROFILE', 'thorough')
+
+# Topic count used when the deadline leaves no time for a sweep
+DEFAULT_NUM_TOPICS = 5
+# Share of the remaining time stages may plan to use; the rest covers
+# estimation error and building the response.
+BUDGET_SAFETY = 0.8
+MIN_SWEEP_SAMPLE = 100
+# Share of the usable remaining time per-comment labeling (sentiment and
+# emotions) may plan to use; the rest is left for key phrases and topics.
+LABEL_SHARE = 0.5
+MIN_LABELED = 100
+
+class StageCosts:
+    """
+    Measured cost per unit of work of each stage (exponentially weighted, per
+    process), updated by every analysis and used to plan deadline-bound ones.
+    Units: 'preprocess', 'sentiment', 'emotions' and 'coherence' per comment,
+    'lda' per comment and pass, 'key_phrases' per call.
+    """
+
+    def __init__(self):
+        # Rough seeds until the first measurements arrive
+        self.costs = {'preprocess': 0.0005, 'sentiment': 0.0001, 'emotions': 0.003, 'coherence': 0.002, 'lda': 0.0005, 'key_phrases': 3.0}
+        self.lock = threading.Lock()
+
+    def record(self, stage, units, seconds):
+        if units <= 0:
+            return
+        with self.lock:
+            self.costs[stage] = 0.7 * self.costs[stage] + 0.3 * seconds / units
+
+    def estimate(self, stage, units):
+        with self.lock:
+            return self.costs[stage] * units
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.costs)
+
+stage_costs = StageCosts()
+
+@contextmanager
+def stage_timer(stage, units):
+    """
+    Times a block of work and records its cost per unit.
+    """
+    started = time.monotonic()
+    yield
+    stage_costs.record(stage, units, time.monotonic() - started)
+
+def get_profile(name):
+    """
+    Returns the named profile, or None if there is no such profile.
+    """
+    return PROFILES.get((name or DEFAULT_PROFILE).strip().lower())
+
+class AnalysisBudget:
+    """
+    Latency budget of one request. Plans the topic sweep and LDA passes from
+    the measured stage costs, decides whether optional stages still fit and
+    records which result sections are partial (and why).
+    """
+
+    def __init__(self, profile, deadline=None):
+        self.profile = profile
+        self.deadline = deadline if deadline is not None else profile.deadline
+        self.started = time.monotonic()
+        self.partial = {}
+        self.reduced = False
+
+    @property
+    def unbounded(self):
+        # The full-quality analysis: thorough, without a deadline
+        return self.deadline is None and self.profile.name == 'thorough'
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def remaining(self):
+        if self.deadline is None:
+            return math.inf
+        return max(0.0, self.deadline - self.elapsed())
+
+    def timeout(self, share=1.0):
+        """
+        Seconds a blocking call (e.g. to OpenAI) may take: `share` of the usable
+        remaining time, or None without a deadline.
+        """
+        if self.deadline is None:
+            return None
+        return self.remaining() * BUDGET_SAFETY * share
+
+    def affords_seconds(self, seconds):
+        return seconds <= self.remaining() * BUDGET_SAFETY
+
+    def affords(self, stage, units, share=1.0):
+        """
+        True if the stage's estimated cost fits in `share` of the usable remaining time.
+        """
+        return stage_costs.estimate(stage, units) <= self.remaining() * BUDGET_SAFETY * share
+
+    def mark_partial(self, section, reason):
+        logger.info(f"Partial {section} ({self.profile.name} profile): {reason}")
+        self.partial[section] = reason
+        if section == 'topics':
+            # However the topic model was cut short, it is rebuilt by the next unbounded analysis
+            self.reduced = True
+
+    def plan_labels(self, num_comments):
+        """
+        Number of comments whose sentiment and emotions fit LABEL_SHARE of the
+        remaining time (at least MIN_LABELED). If that is fewer than all of
+        them, both sections are marked partial.
+        """
+        usable = self.remaining() * BUDGET_SAFETY * LABEL_SHARE
+        if math.isinf(usable):
+            return num_comments
+        per_comment = stage_costs.estimate('sentiment', 1) + stage_costs.estimate('emotions', 1)
+        labeled = min(num_comments, max(MIN_LABELED, int(usable / per_comment)))
+        if labeled < num_comments:
+            reason = f"labeled a sample of {labeled} of {num_comments} comments to meet the deadline"
+            self.mark_partial('sentiment', reason)
+            self.mark_partial('emotions', reason)
+        return labeled
+
+    def sweep_cost(self, num_docs, num_models, passes):
+        return num_models * (stage_costs.estimate('lda', num_docs * passes) + stage_costs.estimate('coherence', num_docs))
+
+    def plan_topics(self, num_docs):
+        """
+        Picks the LDA passes, the sweep range and the sweep sample size that fit
+        the remaining time: the final model gets up to half of it, then the
+        sweep shrinks its sample, its range and finally its passes. Returns a
+        dict with passes, start, limit (None: no sweep) and sample.
+        """
+        profile = self.profile
+        usable = self.remaining() * BUDGET_SAFETY
+
+        passes = profile.passes
+        while passes > 1 and stage_costs.estimate('lda', num_docs * passes) > usable / 2:
+            passes -= 1
+        sweep_budget = usable - stage_costs.estimate('lda', num_docs * passes)
+
+        start, limit = profile.topic_start, profile.topic_limit
+        sample = min(num_docs, profile.sweep_sample or num_docs)
+        sweep_passes = passes
+        while self.sweep_cost(sample, limit - start + 1, sweep_passes) > sweep_budget:
+            if sample > MIN_SWEEP_SAMPLE:
+                sample = max(MIN_SWEEP_SAMPLE, sample // 2)
+            elif limit > start + 1:
+                limit -= 1
+            elif sweep_passes > 1:
+                sweep_passes -= 1
+            else:
+                limit = None
+                break
+
+        plan = {'passes': passes, 'sweep_passes': sweep_passes, 'start': start, 'limit': limit, 'sample': sample}
+        if limit is None:
+            self.mark_partial('topics', f"no time for a topic sweep; used {DEFAULT_NUM_TOPICS} topics and {passes} passes")
+        elif (passes, sweep_passes, limit, sample) != (profile.passes, profile.passes, profile.topic_limit,
+                                                      min(num_docs, profile.sweep_sample or num_docs)):
+            self.mark_partial(
+                'topics', f"topic sweep over {start}-{limit} topics on {sample} comments with {sweep_passes} passes, "
+                          f"final model with {passes} passes"
+            )
+
+        # Anything short of the thorough profile's full sweep is a reduced model
+        thorough = PROFILES['thorough']
+        self.reduced = self.reduced or (passes, sweep_passes, start, limit, sample) != (
+            thorough.passes, thorough.passes, thorough.topic_start, thorough.topic_limit, num_docs
+        )
+        return plan
+
+    def report(self):
+        return {
+            'name': self.profile.name,
+            'deadline': self.deadline,
+            'elapsed': round(self.elapsed(), 3),
+            'partial': self.partial
+        }
@@ -0,0 +1,117 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows: per-process locking only
+    fcntl = None
+
+try:
+    from zoneinfo import ZoneInfo
+    QUOTA_TIMEZONE = ZoneInfo('America/Los_Angeles')
+except Exception:
+    QUOTA_TIMEZONE = timezone.utc
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+# Quota usage directory (one file per API key, shared by all worker processes)
+QUOTA_DIR = '.cache/quota'
+os.makedirs(QUOTA_DIR, exist_ok=True)
+
+# Units per day and the share of them kept back; once only the reserve is
+# left, stale caches are served instead of being revalidated or refetched.
+DAILY_QUOTA = int(os.getenv('YOUTUBE_DAILY_QUOTA', '10000'))
+QUOTA_RESERVE = float(os.getenv('YOUTUBE_QUOTA_RESERVE', '0.1'))
+
+# Cost of one commentThreads.list call
+LIST_COST = 1
+
+_lock = threading.Lock()
+
+def quota_day():
+    """
+    The current quota day; YouTube Data API quotas reset at midnight Pacific time.
+    """
+    return datetime.now(QUOTA_TIMEZONE).strftime('%Y-%m-%d')
+
+class QuotaBudget:
+    """
+    Tracks the units spent with one API key against its daily budget. Usage is
+    kept in a small file (locked while updated) so every process shares it.
+    """
+
+    def __init__(self, api_key, daily_quota=DAILY_QUOTA, reserve=QUOTA_RESERVE):
+        key_hash = hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:16]
+        self.path = os.path.join(QUOTA_DIR, f'{key_hash}.json')
+        self.daily_quota = daily_quota
+        self.reserve_units = int(daily_quota * reserve)
+
+    def _update(self, change):
+        """
+        Applies change(usage) to today's usage under the lock and returns it.
+        """
+        with _lock, open(self.path, 'a+', encoding='utf-8') as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    usage = json.loads(f.read() or '{}')
+                except ValueError:
+                    usage = {}
+                if usage.get('day') != quota_day():
+                    usage = {'day': quota_day(), 'spent': 0, 'calls': 0, 'revalidations': 0, 'not_modified': 0,
+                             'stale_served': 0}
+                if change:
+                    change(usage)
+                    f.seek(0)
+                    f.truncate()
+                    json.dump(usage, f)
+                    f.flush()
+                return usage
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def spend(self, units=LIST_COST):
+        def change(usage):
+            usage['spent'] += units
+            usage['calls'] += 1
+        self._update(change)
+
+    def count(self, event):
+        """
+        Counts a revalidation outcome ('revalidations', 'not_modified', 'stale_served').
+        """
+        def change(usage):
+            usage[event] = usage.get(event, 0) + 1
+        self._update(change)
+
+    def exhaust(self):
+        """
+        Marks today's budget as used up (the API reported quotaExceeded).
+        """
+        def change(usage):
+            usage['spent'] = max(usage['spent'], self.daily_quota)
+        self._update(change)
+
+    def remaining(self):
+        return max(0, self.daily_quota - self._update(None)['spent'])
+
+    def can_spend(self, units, use_reserve=False):
+        """
+        True if units can be spent without dipping into the reserve (or, with
+        use_reserve, without exceeding the daily budget).
+        """
+        floor = 0 if use_reserve else self.reserve_units
+        return self.remaining() - units >= floor
+
+    def stats(self):
+        usage = self._update(None)
+        return dict(usage, daily_quota=self.daily_quota, reserve=self.reserve_units,
+                    remaining=max(0, self.daily_quota - usage['spent']))
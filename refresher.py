@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import zlib
+import random
+import logging
+import threading
+import traceback
+from youtube_api import get_video_id, get_cache_file_path, CACHE_TTL
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, every process refreshes
+    fcntl = None
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+# Request log, scheduler state and the lock electing the refreshing process
+REFRESHER_DIR = '.cache/refresher'
+os.makedirs(REFRESHER_DIR, exist_ok=True)
+HITS_FILE = os.path.join(REFRESHER_DIR, 'hits.log')
+STATE_FILE = os.path.join(REFRESHER_DIR, 'state.json')
+LOCK_FILE = os.path.join(REFRESHER_DIR, 'refresher.lock')
+
+# Watched videos: ids or URLs, one per line ('#' starts a comment), plus WATCH_VIDEOS (comma-separated)
+WATCH_LIST_FILE = os.getenv('WATCH_LIST_FILE', 'watchlist.txt')
+
+# A watched video is refreshed between REFRESH_LEAD and REFRESH_LEAD / 2 seconds
+# before its comment cache expires (the offset within that window is fixed per
+# video), and refreshes are at least REFRESH_SPACING seconds (+/- 50%) apart,
+# so expiries that line up do not turn into bursts.
+REFRESH_LEAD = int(os.getenv('REFRESH_LEAD', '600'))
+REFRESH_SPACING = float(os.getenv('REFRESH_SPACING', '30'))
+REFRESH_TICK = 60
+# After a failed refresh, wait this long before trying the video again.
+REFRESH_RETRY = 300
+# Request counts decay with this half-life when ranking watched videos.
+HIT_HALF_LIFE = 6 * 3600
+
+_started = False
+_started_lock = threading.Lock()
+_watch_list_cache = {'videos': frozenset(), 'loaded_at': 0.0}
+
+def is_watched(video_id):
+    # Requests check the watch list through a copy reloaded once per tick
+    now = time.time()
+    if now - _watch_list_cache['loaded_at'] > REFRESH_TICK:
+        _watch_list_cache['videos'] = frozenset(load_watch_list())
+        _watch_list_cache['loaded_at'] = now
+    return video_id in _watch_list_cache['videos']
+
+def record_request(video_id):
+    """
+    Logs a request for a watched video. Appends are atomic, so every worker
+    process can write to the log; the refresher folds it into request frequencies.
+    """
+    if not is_watched(video_id):
+        return
+    try:
+        with open(HITS_FILE, 'a', encoding='utf-8') as f:
+            f.write(f"{time.time():.0f} {video_id}\n")
+    except OSError as e:
+        logger.error(f"Error recording request: {str(e)}")
+
+def normalize_video_id(entry):
+    entry = entry.strip()
+    if 'youtu' in entry:
+        return get_video_id(entry)
+    return entry or None
+
+def load_watch_list():
+    """
+    Reads the watch list (re-read every cycle, so edits apply without a restart).
+    """
+    entries = os.getenv('WATCH_VIDEOS', '').split(',')
+    try:
+        if os.path.exists(WATCH_LIST_FILE):
+            with open(WATCH_LIST_FILE, 'r', encoding='utf-8') as f:
+                entries.extend(line.split('#')[0] for line in f)
+    except OSError as e:
+        logger.error(f"Error reading watch list: {str(e)}")
+    return sorted({video_id for video_id in map(normalize_video_id, entries) if video_id})
+
+def load_state():
+    try:
+        with open(STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'videos': {}}
+
+def save_state(state):
+    with open(STATE_FILE + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(STATE_FILE + '.tmp', STATE_FILE)
+
+def get_refresher_status():
+    """
+    Returns the watched videos with their request score and refresh times.
+    """
+    state = load_state()
+    watched = load_watch_list()
+    return {
+        'watched': [dict(state['videos'].get(video_id, {}), video_id=video_id) for video_id in watched],
+        'updated': state.get('updated')
+    }
+
+def fold_hits(state, now):
+    """
+    Moves the request log into the decayed per-video request scores.
+    """
+    processing = HITS_FILE + '.processing'
+    try:
+        os.replace(HITS_FILE, processing)
+    except FileNotFoundError:
+        processing = None
+
+    videos = state['videos']
+    for video in videos.values():
+        video['score'] = video.get('score', 0.0) * 0.5 ** ((now - video.get('scored_at', now)) / HIT_HALF_LIFE)
+        video['scored_at'] = now
+    if processing:
+        with open(processing, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) != 2:
+                    continue
+                video = videos.setdefault(parts[1], {'score': 0.0, 'scored_at': now})
+                video['score'] += 0.5 ** ((now - float(parts[0])) / HIT_HALF_LIFE)
+        os.remove(processing)
+    # Forget unwatched videos once nobody asks for them any more
+    for video_id in [video_id for video_id, video in videos.items() if video['score'] < 0.01 and not video.get('watched')]:
+        del videos[video_id]
+
+def refresh_due_at(video_id, cached_at):
+    spread = max(1, REFRESH_LEAD // 2)
+    return cached_at + CACHE_TTL - REFRESH_LEAD + zlib.crc32(video_id.encode('utf-8')) % spread
+
+def due_videos(state, watched, now):
+    """
+    Watched videos whose comment cache expires soon (or is missing), most requested first.
+    """
+    due = []
+    for video_id in watched:
+        video = state['videos'].setdefault(video_id, {'score': 0.0, 'scored_at': now})
+        video['watched'] = True
+        if now - video.get('attempted_at', 0) < min(REFRESH_RETRY, REFRESH_LEAD / 2):
+            continue
+        try:
+            cached_at = os.path.getmtime(get_cache_file_path(video_id))
+        except OSError:
+            cached_at = None
+        video['due_at'] = now if cached_at is None else refresh_due_at(video_id, cached_at)
+        if video['due_at'] <= now:
+            due.append(video_id)
+    for video_id, video in state['videos'].items():
+        if video_id not in watched:
+            video['watched'] = False
+    return sorted(due, key=lambda video_id: -state['videos'][video_id]['score'])
+
+class Refresher:
+    """
+    Keeps watched videos warm: refetches (revalidates) their comments and
+    updates their stored analysis shortly before the comment cache expires.
+    Only the process holding the refresher lock does the work; the others keep
+    trying to take it over in case that process exits.
+    """
+
+    def __init__(self, refresh_video):
+        self.refresh_video = refresh_video
+        self.lock_file = None
+
+    def acquire_lock(self):
+        if self.lock_file:
+            return True
+        lock_file = open(LOCK_FILE, 'a')
+        if fcntl:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+        self.lock_file = lock_file
+        logger.info(f"Background refresher running in process {os.getpid()}")
+        return True
+
+    def run_cycle(self):
+        now = time.time()
+        state = load_state()
+        watched = load_watch_list()
+        fold_hits(state, now)
+        due = due_videos(state, watched, now)
+        state['updated'] = now
+        save_state(state)
+
+        for index, video_id in enumerate(due):
+            if index:
+                time.sleep(REFRESH_SPACING * random.uniform(0.5, 1.5))
+            started = time.time()
+            try:
+                refreshed = self.refresh_video(video_id)
+            except Exception as e:
+                logger.error(f"Error refreshing video ID {video_id}: {str(e)}")
+                refreshed = False
+            state = load_state()
+            video = state['videos'].setdefault(video_id, {'score': 0.0, 'scored_at': started})
+            video['attempted_at'] = started
+            if refreshed:
+                video['refreshed_at'] = started
+                video['refresh_seconds'] = time.time() - started
+                try:
+                    video['due_at'] = refresh_due_at(video_id, os.path.getmtime(get_cache_file_path(video_id)))
+                except OSError:
+                    pass
+                logger.info(f"Refreshed watched video ID {video_id} in {video['refresh_seconds']:.1f}s")
+            else:
+                logger.warning(f"Refreshing watched video ID {video_id} failed; retrying later.")
+            save_state(state)
+
+    def run(self):
+        # Stagger the first cycle of freshly started processes
+        time.sleep(random.uniform(0, REFRESH_TICK / 2))
+        while True:
+            try:
+                if self.acquire_lock():
+                    self.run_cycle()
+            except Exception as e:
+                logger.error(f"Error in background refresher: {str(e)}")
+                logger.error(traceback.format_exc())
+            time.sleep(REFRESH_TICK * random.uniform(0.8, 1.2))
+
+def start_refresher(refresh_video):
+    """
+    Starts the background refresher thread (once per process). refresh_video(video_id)
+    refreshes one video and returns True on success.
+    """
+    global _started
+    with _started_lock:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=Refresher(refresh_video).run, name='refresher', daemon=True).start()
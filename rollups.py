@@ -0,0 +1,163 @@
+import os
+import json
+import logging
+import traceback
+from datetime import datetime, timezone
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+# Rollup directory (one file per video)
+ROLLUP_DIR = '.cache/rollups'
+os.makedirs(ROLLUP_DIR, exist_ok=True)
+
+# Pre-aggregated levels, coarsest first. A query is answered from the coarsest
+# level whose bucket size divides the requested bucket size and range bounds.
+ROLLUP_LEVELS = (('day', 86400), ('hour', 3600), ('minute', 60))
+
+def get_rollup_file_path(video_id):
+    return os.path.join(ROLLUP_DIR, f'{video_id}.json')
+
+def get_seen_file_path(video_id):
+    return os.path.join(ROLLUP_DIR, f'{video_id}.seen.json')
+
+def parse_timestamp(value):
+    """
+    Parses an ISO 8601 timestamp (as returned by the YouTube API) or epoch
+    seconds into epoch seconds. Returns None if the value cannot be parsed.
+    """
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return int(parsed.timestamp())
+    except ValueError:
+        return None
+
+def format_timestamp(seconds):
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).isoformat().replace('+00:00', 'Z')
+
+def new_bucket():
+    return {'comments': 0, 'likes': 0, 'sentiment': {}, 'sentiment_likes': {}, 'emotions': {}, 'emotion_likes': {}}
+
+def add_to_bucket(bucket, other):
+    for key in ('comments', 'likes'):
+        bucket[key] += other[key]
+    for key in ('sentiment', 'sentiment_likes', 'emotions', 'emotion_likes'):
+        for label, count in other[key].items():
+            bucket[key][label] = bucket[key].get(label, 0) + count
+
+def comment_bucket(result, like_count):
+    """
+    A single comment's contribution to a bucket.
+    """
+    bucket = new_bucket()
+    bucket['comments'] = 1
+    bucket['likes'] = like_count
+    bucket['sentiment'][result['sentiment']] = 1
+    bucket['sentiment_likes'][result['sentiment']] = like_count
+    for emotion, score in result['emotions'].items():
+        if score > 0:
+            bucket['emotions'][emotion] = 1
+            bucket['emotion_likes'][emotion] = like_count
+    return bucket
+
+def load_rollups(video_id, include_seen=True):
+    """
+    Loads a video's rollup levels and, if requested, the ids already counted
+    (kept in a separate file so timeline queries do not have to read them).
+    """
+    rollups = {'seen': set(), 'levels': {name: {} for name, _ in ROLLUP_LEVELS}}
+    try:
+        rollup_file = get_rollup_file_path(video_id)
+        if os.path.exists(rollup_file):
+            with open(rollup_file, 'r', encoding='utf-8') as f:
+                rollups['levels'] = json.load(f)
+            if include_seen:
+                with open(get_seen_file_path(video_id), 'r', encoding='utf-8') as f:
+                    rollups['seen'] = set(json.load(f))
+    except Exception as e:
+        logger.error(f"Error loading rollups: {str(e)}")
+    return rollups
+
+def write_json(path, data):
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(path + '.tmp', path)
+
+def save_rollups(video_id, rollups):
+    try:
+        # The seen ids go first: after a crash between the two writes, comments
+        # are missing from the rollups rather than counted twice.
+        write_json(get_seen_file_path(video_id), sorted(rollups['seen']))
+        write_json(get_rollup_file_path(video_id), rollups['levels'])
+    except Exception as e:
+        logger.error(f"Error saving rollups: {str(e)}")
+
+def update_rollups(video_id, records, results):
+    """
+    Adds comments not seen before to the video's minute/hour/day rollups.
+    records maps comment key -> record and results maps comment key ->
+    per-comment result. Comments are counted once, when they first arrive,
+    with their like count at that time; comments without a publish time
+    (caches from before it was kept) are skipped.
+    """
+    try:
+        rollups = load_rollups(video_id)
+        added = 0
+        for key, record in records.items():
+            if key in rollups['seen']:
+                continue
+            published = parse_timestamp(record.get('published_at'))
+            if published is None:
+                continue
+            contribution = comment_bucket(results[key], record.get('like_count') or 0)
+            for name, size in ROLLUP_LEVELS:
+                bucket_key = str(published - published % size)
+                level = rollups['levels'][name]
+                add_to_bucket(level.setdefault(bucket_key, new_bucket()), contribution)
+            rollups['seen'].add(key)
+            added += 1
+        if added:
+            save_rollups(video_id, rollups)
+            logger.info(f"Added {added} comments to rollups for video ID: {video_id}")
+    except Exception as e:
+        logger.error(f"Error updating rollups: {str(e)}")
+        logger.error(traceback.format_exc())
+
+def query_timeline(video_id, bucket_size, start=None, end=None):
+    """
+    Returns sentiment/emotion counts per bucket_size seconds (a multiple of 60)
+    between start (inclusive) and end (exclusive) epoch seconds, merged from
+    the pre-aggregated rollups. Returns None if the video has no rollups.
+    """
+    if not os.path.exists(get_rollup_file_path(video_id)):
+        return None
+    rollups = load_rollups(video_id, include_seen=False)
+
+    for name, size in ROLLUP_LEVELS:
+        if bucket_size % size == 0 and (start is None or start % size == 0) and (end is None or end % size == 0):
+            break
+    else:
+        raise ValueError('Bucket size and range bounds must be multiples of 60 seconds.')
+
+    merged = {}
+    for bucket_key, bucket in rollups['levels'][name].items():
+        bucket_start = int(bucket_key)
+        if (start is not None and bucket_start < start) or (end is not None and bucket_start >= end):
+            continue
+        target = bucket_start - bucket_start % bucket_size
+        add_to_bucket(merged.setdefault(target, new_bucket()), bucket)
+
+    return {
+        'video_id': video_id,
+        'bucket': bucket_size,
+        'resolution': name,
+        'buckets': [dict(start=format_timestamp(target), **merged[target]) for target in sorted(merged)]
+    }
@@ -0,0 +1,355 @@
+import os
+import json
+import math
+import time
+import uuid
+import random
+import bisect
+import logging
+import threading
+import traceback
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from statistics import NormalDist
+from comment_analysis import analyze_comments_with_model, label_comment
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+# Upper bounds (in characters) of the comment length buckets; longer comments
+# fall into the last bucket.
+LENGTH_BUCKETS = (40, 120, 300)
+SENTIMENT_CATEGORIES = ('Positive', 'Negative', 'Neutral')
+
+DEFAULT_MARGIN = 0.03
+DEFAULT_CONFIDENCE = 0.95
+APPROXIMATE_MAX_COMMENTS = 100000
+# Top-level comments fetched per comment of the target sample: the sample is
+# drawn from a pool a few times its size, so the fetch (and its quota cost)
+# stays about constant however long the thread is.
+SAMPLE_POOL_FACTOR = 3
+MIN_PER_STRATUM = 2
+REFINE_BATCH_SIZE = 200
+
+# One small status file per refinement job, so every worker process can serve it.
+REFINEMENT_DIR = '.cache/refinement'
+os.makedirs(REFINEMENT_DIR, exist_ok=True)
+# Job files are kept this long after their last update.
+REFINEMENT_RETENTION = 3600
+# A job not updated for this long (e.g. its worker was restarted) is reported as failed.
+REFINEMENT_STALE_TIMEOUT = 600
+
+# Refinement runs off the request path, a few jobs at a time; beyond
+# MAX_ACTIVE_REFINEMENTS queued or running jobs, new results are not refined.
+REFINEMENT_WORKERS = 2
+MAX_ACTIVE_REFINEMENTS = 8
+_executor = ThreadPoolExecutor(max_workers=REFINEMENT_WORKERS, thread_name_prefix='refinement')
+_active_refinements = set()
+_refinement_lock = threading.Lock()
+
+def get_stratum(record):
+    """
+    Returns the stratum of a comment record: (length bucket, is_reply).
+    """
+    return bisect.bisect_left(LENGTH_BUCKETS, len(record['text'])), bool(record.get('is_reply'))
+
+def z_score(confidence):
+    """
+    Returns the two-sided normal critical value for a confidence level.
+    """
+    return NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+
+def required_sample_size(population, margin=DEFAULT_MARGIN, confidence=DEFAULT_CONFIDENCE):
+    """
+    Sample size needed to estimate any proportion within +/- margin, using the
+    worst case p = 0.5 and the finite population correction.
+    """
+    if population <= 0:
+        return 0
+    n0 = (z_score(confidence) ** 2) * 0.25 / (margin ** 2)
+    return min(population, math.ceil(n0 / (1 + (n0 - 1) / population)))
+
+def approximate_fetch_size(comment_count, margin=DEFAULT_MARGIN, confidence=DEFAULT_CONFIDENCE):
+    """
+    Top-level comments to fetch for an approximate analysis of a video with
+    comment_count comments (None: unknown, sized for a very large thread).
+    The API pages threads newest first, so for long threads the pool (and the
+    estimates) cover only the newest part of the thread.
+    """
+    population = comment_count if comment_count is not None else APPROXIMATE_MAX_COMMENTS
+    sample_size = required_sample_size(population, margin, confidence)
+    return max(1, min(APPROXIMATE_MAX_COMMENTS, SAMPLE_POOL_FACTOR * sample_size))
+
+def build_strata(records, seed=42):
+    """
+    Groups records by stratum, shuffling each stratum so any prefix is a random sample.
+    """
+    strata = {}
+    for record in records:
+        strata.setdefault(get_stratum(record), []).append(record)
+    rng = random.Random(seed)
+    for members in strata.values():
+        rng.shuffle(members)
+    return strata
+
+def allocate_sample(strata, sample_size):
+    """
+    Proportionally allocates sample_size across strata, with a small floor per stratum.
+    """
+    population = sum(len(members) for members in strata.values())
+    allocation = {}
+    for key, members in strata.items():
+        share = round(sample_size * len(members) / population) if population else 0
+        allocation[key] = min(len(members), max(MIN_PER_STRATUM, share))
+    return allocation
+
+def new_tally():
+    return {'n': 0, 'sentiment': Counter(), 'emotions': Counter()}
+
+def add_to_tally(tally, sentiment, emotions):
+    tally['n'] += 1
+    tally['sentiment'][sentiment] += 1
+    for emotion, score in emotions.items():
+        if score > 0:
+            tally['emotions'][emotion] += 1
+
+def estimate_proportions(tallies, populations, field, categories, confidence=DEFAULT_CONFIDENCE):
+    """
+    Stratified estimate of the share of comments in each category, with a
+    normal-approximation confidence interval.
+    """
+    total = sum(populations.values())
+    z = z_score(confidence)
+    estimates = {}
+    for category in categories:
+        proportion = 0.0
+        variance = 0.0
+        for key, tally in tallies.items():
+            n, population = tally['n'], populations[key]
+            if not n:
+                continue
+            stratum_weight = population / total
+            p = tally[field][category] / n
+            proportion += stratum_weight * p
+            fpc = 1 - n / population
+            variance += stratum_weight ** 2 * fpc * p * (1 - p) / max(n - 1, 1)
+        half_width = z * math.sqrt(variance)
+        estimates[category] = {
+            'estimate': round(proportion * total),
+            'proportion': round(proportion, 4),
+            'ci_lower': round(max(0.0, proportion - half_width), 4),
+            'ci_upper': round(min(1.0, proportion + half_width), 4)
+        }
+    return estimates
+
+def summarize_estimates(tallies, populations, confidence=DEFAULT_CONFIDENCE):
+    """
+    Returns (classification_counts, emotion_counts) estimates for the current tallies.
+    """
+    emotion_categories = sorted({emotion for tally in tallies.values() for emotion in tally['emotions']})
+    classification_counts = estimate_proportions(tallies, populations, 'sentiment', SENTIMENT_CATEGORIES, confidence)
+    emotion_counts = estimate_proportions(tallies, populations, 'emotions', emotion_categories, confidence)
+    return classification_counts, emotion_counts
+
+class RefinementJob:
+    """
+    Keeps labeling the unsampled fetched comments in the background, tightening
+    the intervals until all of them have been analyzed (done) and the counts
+    are exact. Refinement stops at the fetched pool: the counts are exact for
+    the whole video only if the pool covers its thread (covers_thread). Its
+    status is saved to a job file after every batch, so every worker process
+    can serve it.
+    """
+
+    def __init__(self, tallies, remaining, populations, confidence, covers_thread):
+        self.id = uuid.uuid4().hex
+        self.tallies = tallies
+        self.remaining = remaining
+        self.populations = populations
+        self.confidence = confidence
+        self.covers_thread = covers_thread
+        self.error = None
+        self.done = False
+
+    def next_batch(self):
+        # Draw from every stratum in proportion to what is left so each
+        # intermediate state is still a stratified random sample.
+        left = sum(len(members) for members in self.remaining.values())
+        batch = []
+        for key, members in self.remaining.items():
+            take = min(len(members), max(1, math.ceil(REFINE_BATCH_SIZE * len(members) / left))) if members else 0
+            batch.extend((key, record) for record in members[:take])
+            del members[:take]
+        return batch
+
+    def run(self):
+        try:
+            while True:
+                batch = self.next_batch()
+                if not batch:
+                    break
+                for key, record in batch:
+                    sentiment, emotions = label_comment(record['text'])
+                    add_to_tally(self.tallies[key], sentiment, emotions)
+                self.save()
+            self.done = True
+            logger.info(f"Refinement job {self.id} completed.")
+        except Exception as e:
+            self.error = str(e)
+            logger.error(f"Error in refinement job {self.id}: {str(e)}")
+            logger.error(traceback.format_exc())
+        finally:
+            with _refinement_lock:
+                _active_refinements.discard(self.id)
+            self.save()
+
+    def status(self):
+        analyzed = sum(tally['n'] for tally in self.tallies.values())
+        classification_counts, emotion_counts = summarize_estimates(self.tallies, self.populations, self.confidence)
+        total = sum(self.populations.values())
+        return {
+            'job_id': self.id,
+            'analyzed_comments': analyzed,
+            'total_comments': total,
+            'done': self.done,
+            'exact': analyzed == total,
+            'covers_thread': self.covers_thread,
+            'error': self.error,
+            'classification_counts': classification_counts,
+            'emotion_counts': emotion_counts
+        }
+
+    def save(self):
+        path = get_refinement_file_path(self.id)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(dict(self.status(), updated=time.time()), f)
+        os.replace(path + '.tmp', path)
+
+def get_refinement_file_path(job_id):
+    return os.path.join(REFINEMENT_DIR, f'{job_id}.json')
+
+def prune_refinement_files():
+    """
+    Deletes the job files of refinements last updated over REFINEMENT_RETENTION ago.
+    """
+    cutoff = time.time() - REFINEMENT_RETENTION
+    for entry in os.scandir(REFINEMENT_DIR):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+def start_refinement(tallies, remaining, populations, confidence, covers_thread):
+    """
+    Queues a refinement job on the bounded refinement executor, or returns None
+    if this process already has MAX_ACTIVE_REFINEMENTS queued or running.
+    """
+    job = RefinementJob(tallies, remaining, populations, confidence, covers_thread)
+    with _refinement_lock:
+        if len(_active_refinements) >= MAX_ACTIVE_REFINEMENTS:
+            logger.warning("Too many refinement jobs; the approximate result will not be refined.")
+            return None
+        _active_refinements.add(job.id)
+    prune_refinement_files()
+    job.save()
+    _executor.submit(job.run)
+    return job
+
+def get_refinement_status(job_id):
+    """
+    Returns the current estimates of a refinement job, or None if it is unknown.
+    """
+    try:
+        with open(get_refinement_file_path(job_id), 'r', encoding='utf-8') as f:
+            status = json.load(f)
+    except (OSError, ValueError):
+        return None
+    updated = status.pop('updated')
+    if not status['done'] and not status['error'] and time.time() - updated > REFINEMENT_STALE_TIMEOUT:
+        # The process running it was stopped
+        status['error'] = 'Refinement stopped before completing.'
+    return status
+
+def analyze_comments_approximately(records, margin=DEFAULT_MARGIN, confidence=DEFAULT_CONFIDENCE, refine=False,
+                                   budget=None, thread_comments=None):
+    """
+    Analyzes a stratified sample (by length bucket and reply/top-level) sized so
+    the sentiment and emotion proportions fall within +/- margin at the given
+    confidence, and reports them with confidence intervals. budget (a
+    profiles.AnalysisBudget) bounds the analysis of the sample.
+
+    The estimates cover the fetched records only. These may be just the newest
+    threads, with a few inline replies each (see approximate_fetch_size), and
+    the sample says nothing about what was not fetched: covers_thread reports
+    whether the records hold all thread_comments (the video's comment count).
+    """
+    try:
+        strata = build_strata(records)
+        total = len(records)
+        covers_thread = thread_comments is not None and total >= thread_comments
+        populations = {key: len(members) for key, members in strata.items()}
+        sample_size = required_sample_size(total, margin, confidence)
+        allocation = allocate_sample(strata, sample_size)
+
+        sample = []
+        weights = []
+        for key, members in strata.items():
+            n = allocation[key]
+            sample.extend((key, record) for record in members[:n])
+            weights.extend([populations[key] / n] * n)
+        logger.info(
+            f"Sampled {len(sample)} of {total} fetched comments ({thread_comments} in the thread) "
+            f"across {len(strata)} strata."
+        )
+
+        analysis, details = analyze_comments_with_model(
+            [record['text'] for _, record in sample], weights=weights, return_details=True, budget=budget
+        )
+        if not analysis:
+            return None
+
+        tallies = {key: new_tally() for key in strata}
+        unlabeled = {key: [] for key in strata}
+        for (key, record), sentiment, emotions in zip(sample, details['sentiments'], details['emotions']):
+            if sentiment is None:
+                # Not labeled in time; left for refinement
+                unlabeled[key].append(record)
+                continue
+            add_to_tally(tallies[key], sentiment, emotions)
+        labeled = sum(tally['n'] for tally in tallies.values())
+        classification_counts, emotion_counts = summarize_estimates(tallies, populations, confidence)
+
+        analysis['summary'] += (
+            f"Approximate results from {labeled} sampled comments "
+            f"(+/-{margin * 100:.1f}% at {confidence * 100:.0f}% confidence).\n"
+        )
+        if not covers_thread:
+            analysis['summary'] += (
+                f"They cover the newest {total} fetched comments, not the whole thread"
+                f"{f' of {thread_comments} comments' if thread_comments is not None else ''}.\n"
+            )
+        analysis['classification_counts'] = classification_counts
+        analysis['emotion_counts'] = emotion_counts
+
+        refinement_job = None
+        if refine and labeled < total:
+            remaining = {key: unlabeled[key] + members[allocation[key]:] for key, members in strata.items()}
+            job = start_refinement(tallies, remaining, populations, confidence, covers_thread)
+            refinement_job = job.id if job else None
+        analysis['approximation'] = {
+            'sampled_comments': labeled,
+            'total_comments': total,
+            'thread_comments': thread_comments,
+            'covers_thread': covers_thread,
+            'margin': margin,
+            'confidence': confidence,
+            'exact': labeled == total,
+            'refinement_job': refinement_job
+        }
+        return analysis
+
+    except Exception as e:
+        logger.error(f"Error in analyze_comments_approximately: {str(e)}")
+        logger.error(traceback.format_exc())
+        return None
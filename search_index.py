@@ -0,0 +1,176 @@
+import os
+import bisect
+from functools import lru_cache
+import numpy as np
+from comment_analysis import preprocess_text
+
+# Posting lists are stored as gaps between sorted row ids, each list packed
+# with the narrowest unsigned width that fits its largest gap, so decoding is
+# a single frombuffer + cumsum.
+_WIDTHS = {1: np.uint8, 2: np.uint16, 4: np.uint32}
+
+def encode_postings(rows):
+    """
+    Delta-encodes a sorted list of row ids into (width, bytes).
+    """
+    gaps = np.diff(np.asarray(rows, dtype=np.int64), prepend=0)
+    largest = int(gaps.max()) if len(gaps) else 0
+    width = 1 if largest < (1 << 8) else 2 if largest < (1 << 16) else 4
+    return width, gaps.astype(_WIDTHS[width]).tobytes()
+
+def decode_postings(blob, start, end, width):
+    """
+    Decodes one posting list back into sorted row ids.
+    """
+    gaps = np.frombuffer(blob[start:end], dtype=_WIDTHS[int(width)])
+    return np.cumsum(gaps, dtype=np.int64)
+
+def write_inverted_index(index_dir, token_lists):
+    """
+    Writes an inverted index (term -> compressed posting list of row ids) for
+    the given per-row token lists. Terms are stored sorted so prefix queries
+    are a binary search.
+    """
+    postings = {}
+    for row, tokens in enumerate(token_lists):
+        for token in set(tokens):
+            postings.setdefault(token, []).append(row)
+
+    terms = sorted(postings)
+    encoded_terms = [term.encode('utf-8') for term in terms]
+    term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    term_offsets[1:] = np.cumsum([len(term) for term in encoded_terms])
+    with open(os.path.join(index_dir, 'index_terms.bin'), 'wb') as f:
+        f.write(b''.join(encoded_terms))
+    posting_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    posting_widths = np.zeros(len(terms), dtype=np.uint8)
+    with open(os.path.join(index_dir, 'index_postings.bin'), 'wb') as f:
+        for position, term in enumerate(terms):
+            width, encoded = encode_postings(postings[term])
+            f.write(encoded)
+            posting_widths[position] = width
+            posting_offsets[position + 1] = posting_offsets[position] + len(encoded)
+    np.save(os.path.join(index_dir, 'index_term_offsets.npy'), term_offsets)
+    np.save(os.path.join(index_dir, 'index_posting_offsets.npy'), posting_offsets)
+    np.save(os.path.join(index_dir, 'index_posting_widths.npy'), posting_widths)
+
+def load_inverted_index(index_dir):
+    """
+    Loads the sorted term list and memory-maps the posting lists of an index.
+    """
+    term_offsets = np.load(os.path.join(index_dir, 'index_term_offsets.npy'))
+    with open(os.path.join(index_dir, 'index_terms.bin'), 'rb') as f:
+        terms_blob = f.read()
+    terms = [terms_blob[term_offsets[i]:term_offsets[i + 1]].decode('utf-8') for i in range(len(term_offsets) - 1)]
+    postings_path = os.path.join(index_dir, 'index_postings.bin')
+    postings = np.memmap(postings_path, dtype=np.uint8, mode='r') if os.path.getsize(postings_path) else np.zeros(0, np.uint8)
+    return {
+        'terms': terms,
+        'term_ids': {term: position for position, term in enumerate(terms)},
+        'postings': postings,
+        'posting_offsets': np.load(os.path.join(index_dir, 'index_posting_offsets.npy'), mmap_mode='r'),
+        'posting_widths': np.load(os.path.join(index_dir, 'index_posting_widths.npy'), mmap_mode='r')
+    }
+
+def get_postings(index, term_id):
+    offsets = index['posting_offsets']
+    return decode_postings(index['postings'], offsets[term_id], offsets[term_id + 1], index['posting_widths'][term_id])
+
+def decode_posting_range(index, start, end):
+    """
+    Decodes the posting lists of terms start..end-1 (stored back to back) into
+    one array of row ids, unsorted and with repeats. Each run of lists with the
+    same width is read as one slice, and all gaps share one cumsum.
+    """
+    if start == end:
+        return np.zeros(0, dtype=np.int64)
+    postings = np.asarray(index['postings'])
+    offsets = np.asarray(index['posting_offsets'][start:end + 1], dtype=np.int64)
+    widths = np.asarray(index['posting_widths'][start:end]).astype(np.int64)
+    run_starts = np.concatenate(([0], np.flatnonzero(np.diff(widths)) + 1, [len(widths)]))
+    gaps = np.concatenate([
+        postings[offsets[first]:offsets[last]].view(_WIDTHS[int(widths[first])]).astype(np.int64)
+        for first, last in zip(run_starts[:-1], run_starts[1:])
+    ])
+    totals = np.cumsum(gaps)
+    # Every list restarts from 0: subtract the running total before it
+    counts = np.diff(offsets) // widths
+    ends = np.cumsum(counts)
+    bases = np.concatenate(([0], totals[ends[:-1] - 1]))
+    return totals - np.repeat(bases, counts)
+
+def intersect_sorted(rows, other, n_rows):
+    """
+    Rows (sorted) that are also in other (sorted): a binary search of the
+    shorter list in a much longer one, otherwise a mask over the rows.
+    """
+    if len(rows) > len(other):
+        rows, other = other, rows
+    if len(rows) * 16 < len(other):
+        positions = np.searchsorted(other, rows)
+        found = positions < len(other)
+        found[found] = other[positions[found]] == rows[found]
+        return rows[found]
+    mask = np.zeros(n_rows, dtype=bool)
+    mask[other] = True
+    return rows[mask[rows]]
+
+def union_rows(row_lists, n_rows):
+    """
+    Sorted union of several sorted row id arrays, by marking a mask over the rows.
+    """
+    if len(row_lists) == 1:
+        return row_lists[0]
+    mask = np.zeros(n_rows, dtype=bool)
+    for rows in row_lists:
+        mask[rows] = True
+    return np.flatnonzero(mask)
+
+@lru_cache(maxsize=4096)
+def query_tokens(term):
+    return tuple(preprocess_text(term).split())
+
+def match_term(index, term, n_rows):
+    """
+    Row ids matching one query term; 'prefix*' matches every term with that prefix.
+    Returns None for terms that carry no meaning after preprocessing (stop words).
+    """
+    if term.endswith('*'):
+        prefix = term[:-1].lower()
+        if not prefix:
+            return None
+        start = bisect.bisect_left(index['terms'], prefix)
+        end = bisect.bisect_left(index['terms'], prefix + '\U0010ffff')
+        if end - start == 1:
+            return get_postings(index, start)
+        mask = np.zeros(n_rows, dtype=bool)
+        mask[decode_posting_range(index, start, end)] = True
+        return np.flatnonzero(mask)
+
+    tokens = query_tokens(term)
+    if not tokens:
+        return None
+    rows = None
+    for token in tokens:
+        term_id = index['term_ids'].get(token)
+        matches = get_postings(index, term_id) if term_id is not None else np.zeros(0, dtype=np.int64)
+        rows = matches if rows is None else intersect_sorted(rows, matches, n_rows)
+    return rows
+
+def evaluate_query(index, query, n_rows):
+    """
+    Evaluates a boolean query over an index of n_rows rows: whitespace-separated
+    terms are ANDed, clauses separated by OR are unioned, and a trailing *
+    makes a term a prefix match. Returns the sorted matching row ids.
+    """
+    clauses = []
+    for clause in query.split(' OR '):
+        clause_rows = None
+        matches = [match_term(index, term, n_rows) for term in clause.split()]
+        for rows in sorted((rows for rows in matches if rows is not None), key=len):
+            clause_rows = rows if clause_rows is None else intersect_sorted(clause_rows, rows, n_rows)
+        if clause_rows is not None:
+            clauses.append(clause_rows)
+    if not clauses:
+        return np.zeros(0, dtype=np.int64)
+    return union_rows(clauses, n_rows)
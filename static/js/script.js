@@ -5,6 +5,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const chartsDiv = document.getElementById('charts');
     const aiImageContainer = document.getElementById('ai-image-container');
     const aiImage = document.getElementById('ai-image');
+    let pollingImageId = null;
 
     form.addEventListener('submit', async (e) => {
         e.preventDefault();
@@ -22,12 +23,14 @@ document.addEventListener('DOMContentLoaded', () => {
             <div id="emotion-chart" class="chart-container glass p-4 md:col-span-2"></div>
         `;
         aiImageContainer.style.display = 'none';
+        pollingImageId = null;
 
         try {
             const response = await fetch('/analyze', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/x-www-form-urlencoded',
+                    'Accept': 'application/x-ndjson',
                 },
                 body: `video_url=${encodeURIComponent(videoUrl)}`,
             });
@@ -37,9 +40,23 @@ document.addEventListener('DOMContentLoaded', () => {
                 throw new Error(errorData.error || 'Failed to analyze comments');
             }
 
-            const data = await response.json();
-            displayResults(data);
-            renderCharts(data);
+            if (!(response.headers.get('Content-Type') || '').includes('application/x-ndjson')) {
+                const data = await response.json();
+                displayResults(data);
+                renderCharts(data);
+                return;
+            }
+
+            // Each line is one result section; render it as soon as it arrives.
+            const data = {};
+            await readChunks(response, (chunk) => {
+                if (chunk.stage === 'error') {
+                    throw new Error(chunk.error || 'Failed to analyze comments');
+                }
+                Object.assign(data, chunk.data);
+                displayResults(data);
+                renderCharts(chunk.data);
+            });
         } catch (error) {
             resultsDiv.innerHTML = `<p class="text-red-300 font-bold">Error: ${error.message}</p>`;
             chartsDiv.innerHTML = '';
@@ -49,11 +66,48 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    async function readChunks(response, onChunk) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            for (const line of lines) {
+                if (line.trim()) {
+                    onChunk(JSON.parse(line));
+                }
+            }
+        }
+        if (buffer.trim()) {
+            onChunk(JSON.parse(buffer));
+        }
+    }
+
     function displayResults(data) {
+        const firstRender = resultsDiv.innerHTML === '';
         let resultsHTML = '<h2 class="text-3xl font-bold mb-6 text-center">Analysis Results</h2>';
 
+        // Sections cut short to meet the profile's deadline
+        if (data.profile && Object.keys(data.profile.partial).length) {
+            const reasons = Object.entries(data.profile.partial)
+                .map(([section, reason]) => `<li>${section.replace(/_/g, ' ')}: ${reason}</li>`)
+                .join('');
+            resultsHTML += `
+                <div class="mb-6 glass p-4 text-yellow-200">
+                    <p>Partial results (${data.profile.name} profile):</p>
+                    <ul class="list-disc list-inside">${reasons}</ul>
+                </div>
+            `;
+        }
+
         for (const [key, value] of Object.entries(data)) {
-            if (!['sentiment_chart', 'topics_chart', 'emotion_chart', 'ai_image_url', 'video_url'].includes(key)) {
+            if (!['sentiment_chart', 'topics_chart', 'emotion_chart', 'ai_image_url', 'video_url', 'dedup_stats', 'incremental_stats', 'classification_counts', 'emotion_counts', 'approximation', 'visualization_data', 'ai_image', 'profile'].includes(key)) {
                 const title = key.replace(/_/g, ' ').replace(/\b\w/g, l => l.toUpperCase());
                 resultsHTML += `
                     <div class="mb-6 glass p-6 hover:shadow-lg transition-all duration-300">
@@ -71,8 +125,15 @@ document.addEventListener('DOMContentLoaded', () => {
             aiImageContainer.style.display = 'block';
         } else {
             aiImageContainer.style.display = 'none';
+            // The image is generated in the background; poll until it is stored.
+            if (data.ai_image && data.ai_image.status === 'pending') {
+                pollImage(data.ai_image.image_id);
+            }
         }
 
+        if (!firstRender) {
+            return;
+        }
         resultsDiv.style.opacity = 0;
         let opacity = 0;
         const fadeIn = setInterval(() => {
@@ -85,6 +146,33 @@ document.addEventListener('DOMContentLoaded', () => {
         }, 50);
     }
 
+    async function pollImage(imageId) {
+        if (pollingImageId === imageId) {
+            return;
+        }
+        pollingImageId = imageId;
+        for (let attempt = 0; attempt < 90 && pollingImageId === imageId; attempt++) {
+            await new Promise(resolve => setTimeout(resolve, 2000));
+            try {
+                const response = await fetch(`/ai-image/${imageId}`);
+                if (!response.ok) {
+                    return;
+                }
+                const image = await response.json();
+                if (pollingImageId !== imageId || image.status === 'failed') {
+                    return;
+                }
+                if (image.status === 'ready') {
+                    aiImage.src = image.url;
+                    aiImageContainer.style.display = 'block';
+                    return;
+                }
+            } catch (error) {
+                return;
+            }
+        }
+    }
+
     function renderCharts(data) {
         const commonLayout = {
             font: { family: 'Poppins, sans-serif', color: '#ffffff' },
@@ -0,0 +1,51 @@
+import gc
+import logging
+import traceback
+from textblob import TextBlob
+import text2emotion as te
+from comment_analysis import preprocess_text, get_sentiment_score
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+WARMUP_COMMENT = "Loved the audio in this video, but the editing was too slow and it made me sad."
+
+def warm_up_models():
+    """
+    Loads every lazily initialized NLP resource (WordNet, the NLTK stopwords and
+    tokenizer, the TextBlob lexicon and the text2emotion data) by running one
+    comment through each stage, then freezes the heap so forked workers share
+    these objects copy-on-write instead of dirtying them during garbage collection.
+    """
+    try:
+        get_sentiment_score(preprocess_text(WARMUP_COMMENT).split())
+        TextBlob(WARMUP_COMMENT).sentiment
+        te.get_emotion(WARMUP_COMMENT)
+        logger.info("NLP models warmed up.")
+    except Exception as e:
+        logger.error(f"Error warming up models: {str(e)}")
+        logger.error(traceback.format_exc())
+    gc.collect()
+    gc.freeze()
+
+def get_memory_usage():
+    """
+    Returns resident (RSS), proportional (PSS) and shared memory of the current
+    process in kB. PSS splits shared pages between the processes sharing them,
+    so it shows how much each forked worker really costs.
+    """
+    usage = {}
+    for path in ('/proc/self/smaps_rollup', '/proc/self/status'):
+        try:
+            with open(path, 'r') as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    if key in ('Rss', 'VmRSS'):
+                        usage.setdefault('rss_kb', int(value.split()[0]))
+                    elif key == 'Pss':
+                        usage['pss_kb'] = int(value.split()[0])
+                    elif key in ('Shared_Clean', 'Shared_Dirty'):
+                        usage['shared_kb'] = usage.get('shared_kb', 0) + int(value.split()[0])
+        except OSError:
+            continue
+    return usage
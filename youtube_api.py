@@ -2,8 +2,12 @@ import os
 import json
 import time
 import logging
+import threading
+from collections import OrderedDict
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 import traceback
+from quota import QuotaBudget, LIST_COST
 
 # Initialize logging
 logger = logging.getLogger(__name__)
@@ -11,10 +15,24 @@ logger = logging.getLogger(__name__)
 # YouTube API key
 YOUTUBE_API_KEY = os.getenv('YOUTUBE_API_KEY')
 
+# Optional API endpoint override (e.g. a local stand-in server for load tests)
+YOUTUBE_API_BASE_URL = os.getenv('YOUTUBE_API_BASE_URL')
+
+# Daily quota units spent with this key (shared by all processes)
+quota_budget = QuotaBudget(YOUTUBE_API_KEY)
+
 # Cache directory
 CACHE_DIR = '.cache/youtube_comments'
 os.makedirs(CACHE_DIR, exist_ok=True)
 
+# Seconds cached comments are served without refetching
+CACHE_TTL = 3600
+
+# Video comment counts (per process), cached as long as the comments
+MAX_COMMENT_COUNTS = 1000
+_comment_counts = OrderedDict()
+_comment_counts_lock = threading.Lock()
+
 def get_video_id(url):
     """
     Extracts the video ID from a YouTube URL.
@@ -36,37 +54,200 @@ def get_cache_file_path(video_id):
     """
     return os.path.join(CACHE_DIR, f'{video_id}.json')
 
-def get_cached_comments(video_id):
+def normalize_comment_record(comment):
     """
-    Retrieves cached comments for a given video ID if cache is valid (1 hour).
+    Converts a cached comment (plain text in older caches) into a comment record.
+    """
+    if isinstance(comment, dict):
+        return comment
+    return {'id': None, 'text': comment, 'is_reply': False}
+
+def load_cache(video_id):
+    """
+    Loads a video's cache entry (timestamp, complete, etag, newest_id and the
+    comment records) regardless of its age. Returns None if there is none.
     """
     try:
         cache_file = get_cache_file_path(video_id)
         if os.path.exists(cache_file):
             with open(cache_file, 'r', encoding='utf-8') as f:
                 cached_data = json.load(f)
-            if time.time() - cached_data['timestamp'] < 3600:  # 1 hour
-                logger.info(f"Using cached comments for video ID: {video_id}")
-                return cached_data['comments']
+            cached_data['comments'] = [normalize_comment_record(comment) for comment in cached_data['comments']]
+            return cached_data
     except Exception as e:
         logger.error(f"Error retrieving cached comments: {str(e)}")
     return None
 
-def cache_comments(video_id, comments):
+def cache_covers(cached_data, max_results):
+    """
+    True if a cache entry holds at least max_results top-level comments (or the complete thread).
+    """
+    top_level = sum(1 for record in cached_data['comments'] if not record['is_reply'])
+    return not max_results or top_level >= max_results or cached_data.get('complete', False)
+
+def get_cached_comments(video_id, max_results=None):
+    """
+    Retrieves cached comment records for a given video ID if cache is valid (1 hour)
+    and holds at least max_results top-level comments (or the complete thread).
+    """
+    cached_data = load_cache(video_id)
+    if cached_data and time.time() - cached_data['timestamp'] < CACHE_TTL:
+        if not cache_covers(cached_data, max_results):
+            logger.info(f"Cached comments for video ID {video_id} do not cover {max_results} comments.")
+            return None
+        logger.info(f"Using cached comments for video ID: {video_id}")
+        return cached_data['comments']
+    return None
+
+def has_fresh_cache(video_id):
     """
-    Caches comments for a given video ID.
+    Cheap check (no file read) for whether a video's comments were cached
+    within the TTL.
+    """
+    try:
+        return time.time() - os.path.getmtime(get_cache_file_path(video_id)) < CACHE_TTL
+    except OSError:
+        return False
+
+def cache_comments(video_id, comments, complete=False, etag=None):
+    """
+    Caches comment records for a given video ID, with the first page's ETag and
+    the newest top-level comment id used to revalidate it once it expires.
     """
     try:
         cache_file = get_cache_file_path(video_id)
-        with open(cache_file, 'w', encoding='utf-8') as f:
-            json.dump({'timestamp': time.time(), 'comments': comments}, f)
+        newest_id = next((comment['id'] for comment in comments if not comment['is_reply']), None)
+        with open(cache_file + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'timestamp': time.time(), 'complete': complete, 'etag': etag, 'newest_id': newest_id,
+                       'comments': comments}, f)
+        os.replace(cache_file + '.tmp', cache_file)
         logger.info(f"Comments cached for video ID: {video_id}")
     except Exception as e:
         logger.error(f"Error caching comments: {str(e)}")
 
-def get_video_comments(video_url, max_results=500):
+def build_youtube_client():
+    """
+    Builds the YouTube Data API client, pointed at YOUTUBE_API_BASE_URL if set.
+    """
+    client_options = {'api_endpoint': YOUTUBE_API_BASE_URL.rstrip('/') + '/'} if YOUTUBE_API_BASE_URL else None
+    return build('youtube', 'v3', developerKey=YOUTUBE_API_KEY, client_options=client_options)
+
+def build_comment_record(comment, is_reply):
+    """
+    Builds a comment record from a YouTube API comment resource.
+    """
+    snippet = comment["snippet"]
+    return {
+        'id': comment["id"],
+        'text': snippet["textDisplay"],
+        'is_reply': is_reply,
+        'published_at': snippet.get("publishedAt"),
+        'like_count': snippet.get("likeCount", 0),
+        'author': snippet.get("authorDisplayName"),
+        'author_channel_id': snippet.get("authorChannelId", {}).get("value")
+    }
+
+def select_comment_records(records, max_results, include_replies=False):
+    """
+    Keeps the first max_results top-level comments, plus their replies if requested.
+    """
+    selected = []
+    top_level = 0
+    for record in records:
+        if record['is_reply']:
+            if include_replies and top_level <= max_results:
+                selected.append(record)
+            continue
+        top_level += 1
+        if top_level > max_results:
+            break
+        selected.append(record)
+    return selected
+
+def fetch_comment_page(youtube, video_id, max_results, page_token=None, etag=None):
     """
-    Retrieves comments from a YouTube video given its URL.
+    Fetches one page of comment threads (newest first), charging it to the
+    quota budget. With etag, returns None if the API answers 304 Not Modified.
+    """
+    request = youtube.commentThreads().list(
+        part="snippet,replies",
+        videoId=video_id,
+        textFormat="plainText",
+        maxResults=max_results,
+        pageToken=page_token
+    )
+    if etag:
+        request.headers['If-None-Match'] = etag
+    quota_budget.spend(LIST_COST)
+    try:
+        return request.execute()
+    except HttpError as e:
+        if e.resp.status == 304:
+            return None
+        if e.resp.status == 403 and b'quotaExceeded' in (e.content or b''):
+            quota_budget.exhaust()
+        raise
+
+def is_unchanged(first_page, cached_data):
+    """
+    Revalidation check: the first page has the cached ETag or the same newest
+    comment. (Only new top-level comments are detected this way; edits, likes
+    and new replies on older threads wait for a full refetch after a cold miss.)
+    """
+    if first_page is None:
+        return True
+    if first_page.get('etag') and first_page['etag'] == cached_data.get('etag'):
+        return True
+    items = first_page.get('items', [])
+    return bool(items) and items[0]['snippet']['topLevelComment']['id'] == cached_data.get('newest_id')
+
+def serve_stale(video_id, cached_data, max_results, include_replies, reason):
+    logger.warning(f"Serving stale cached comments for video ID {video_id}: {reason}")
+    quota_budget.count('stale_served')
+    return select_comment_records(cached_data['comments'], max_results, include_replies)
+
+def get_comment_count(video_url):
+    """
+    Returns a video's total comment count (top-level comments and replies) from
+    its statistics, or None if it is unavailable. Costs one quota unit.
+    """
+    try:
+        video_id = get_video_id(video_url)
+        if not YOUTUBE_API_KEY or not video_id:
+            return None
+        with _comment_counts_lock:
+            cached = _comment_counts.get(video_id)
+        if cached and time.time() - cached[0] < CACHE_TTL:
+            return cached[1]
+        if not quota_budget.can_spend(LIST_COST):
+            return None
+        quota_budget.spend(LIST_COST)
+        response = build_youtube_client().videos().list(part="statistics", id=video_id).execute()
+        items = response.get("items", [])
+        if not items or "commentCount" not in items[0].get("statistics", {}):
+            return None
+        comment_count = int(items[0]["statistics"]["commentCount"])
+        with _comment_counts_lock:
+            _comment_counts[video_id] = (time.time(), comment_count)
+            _comment_counts.move_to_end(video_id)
+            while len(_comment_counts) > MAX_COMMENT_COUNTS:
+                _comment_counts.popitem(last=False)
+        return comment_count
+    except Exception as e:
+        logger.error(f"Error fetching comment count: {str(e)}")
+        return None
+
+def get_video_comment_records(video_url, max_results=500, include_replies=False, refresh=False):
+    """
+    Retrieves comment records ({'id', 'text', 'is_reply', 'published_at', 'like_count',
+    'author', 'author_channel_id'}) from a YouTube video given its URL.
+    max_results limits top-level comments; replies returned inline by the API are
+    included when include_replies is set. With refresh, a cache that has not
+    expired yet is revalidated as if it had (used by the background refresher).
+
+    Expired caches are revalidated with a single first-page request before
+    refetching the thread. When the daily quota is down to its reserve (or the
+    API rejects a request), stale cached comments are served instead.
     """
     try:
         if not YOUTUBE_API_KEY:
@@ -79,41 +260,92 @@ def get_video_comments(video_url, max_results=500):
             return None
 
         # Check cache
-        cached_comments = get_cached_comments(video_id)
-        if cached_comments:
-            return cached_comments[:max_results]
+        cached_data = load_cache(video_id)
+        if cached_data and not cache_covers(cached_data, max_results):
+            logger.info(f"Cached comments for video ID {video_id} do not cover {max_results} comments.")
+            cached_data = None
+        if cached_data and not refresh and time.time() - cached_data['timestamp'] < CACHE_TTL:
+            logger.info(f"Using cached comments for video ID: {video_id}")
+            return select_comment_records(cached_data['comments'], max_results, include_replies)
+
+        # Refreshing a stale cache must leave the reserve alone; a cold miss may use it
+        use_reserve = cached_data is None
+        if not quota_budget.can_spend(LIST_COST, use_reserve=use_reserve):
+            if cached_data:
+                return serve_stale(video_id, cached_data, max_results, include_replies, "quota budget is low")
+            logger.error("YouTube API daily quota budget exhausted.")
+            return None
 
         # Initialize YouTube API client
-        youtube = build('youtube', 'v3', developerKey=YOUTUBE_API_KEY)
+        youtube = build_youtube_client()
+
+        page_size = min(100, max_results)
+        first_page = None
+        if cached_data:
+            # Revalidate: one first-page request, reused as the first page of a refetch
+            quota_budget.count('revalidations')
+            try:
+                first_page = fetch_comment_page(youtube, video_id, page_size, etag=cached_data.get('etag'))
+            except HttpError as e:
+                return serve_stale(video_id, cached_data, max_results, include_replies, f"revalidation failed ({e.resp.status})")
+            if is_unchanged(first_page, cached_data):
+                logger.info(f"Cached comments for video ID {video_id} are still current.")
+                quota_budget.count('not_modified')
+                cache_comments(video_id, cached_data['comments'], complete=cached_data.get('complete', False),
+                               etag=cached_data.get('etag'))
+                return select_comment_records(cached_data['comments'], max_results, include_replies)
 
-        comments = []
+        records = []
+        top_level = 0
         next_page_token = None
+        etag = None
+        response = first_page
 
-        while len(comments) < max_results:
-            request = youtube.commentThreads().list(
-                part="snippet",
-                videoId=video_id,
-                textFormat="plainText",
-                maxResults=min(100, max_results - len(comments)),
-                pageToken=next_page_token
-            )
-            response = request.execute()
+        while top_level < max_results:
+            if response is None:
+                if not quota_budget.can_spend(LIST_COST, use_reserve=use_reserve):
+                    if cached_data:
+                        return serve_stale(video_id, cached_data, max_results, include_replies, "quota budget is low")
+                    logger.warning(f"Quota budget low; keeping the {top_level} comments fetched for video ID: {video_id}")
+                    break
+                try:
+                    response = fetch_comment_page(
+                        youtube, video_id, min(100, max_results - top_level), page_token=next_page_token
+                    )
+                except HttpError as e:
+                    if cached_data:
+                        return serve_stale(video_id, cached_data, max_results, include_replies, f"refetch failed ({e.resp.status})")
+                    raise
+            if etag is None:
+                etag = response.get('etag')
 
             for item in response.get("items", []):
-                comment = item["snippet"]["topLevelComment"]["snippet"]["textDisplay"]
-                comments.append(comment)
+                records.append(build_comment_record(item["snippet"]["topLevelComment"], is_reply=False))
+                top_level += 1
+                for reply in item.get("replies", {}).get("comments", []):
+                    records.append(build_comment_record(reply, is_reply=True))
 
             next_page_token = response.get("nextPageToken")
+            response = None
             if not next_page_token:
                 break
 
         # Cache the comments
-        cache_comments(video_id, comments)
+        cache_comments(video_id, records, complete=not next_page_token, etag=etag)
 
-        logger.info(f"Fetched {len(comments)} comments for video ID: {video_id}")
-        return comments[:max_results]
+        logger.info(f"Fetched {top_level} comments for video ID: {video_id}")
+        return select_comment_records(records, max_results, include_replies)
 
     except Exception as e:
         logger.error(f"An error occurred while fetching comments: {str(e)}")
         logger.error(traceback.format_exc())
         return None
+
+def get_video_comments(video_url, max_results=500):
+    """
+    Retrieves top-level comment texts from a YouTube video given its URL.
+    """
+    records = get_video_comment_records(video_url, max_results=max_results)
+    if records is None:
+        return None
+    return [record['text'] for record in records]